@@ -0,0 +1,447 @@
+"""
+picks moves for the engine - negamax with alpha-beta pruning and iterative deepening
+built on GameState.getValidMoves/makeMove/undoMove, and cut off by a deadline in milliseconds or nodes
+moves are tried hash move first, then captures by MVV-LVA, killers and quiets by history - quiets are only
+generated once the captures failed to cut the node off
+leaves are resolved by a quiescence search over captures, skipping the ones static exchange evaluation says lose
+with an endgame tablebase (ChessTablebase.Tablebase) positions it covers are scored exactly without searching
+"""
+import time
+from array import array
+
+import ChessEngine
+import ChessEvaluation
+import ChessTablebase
+
+CHECKMATE = 100000
+STALEMATE = 0
+DEFAULT_DEPTH = 3  # used when no depth, time or node limit or stop event is given
+MAX_PLY = 64
+# any score at least this far from zero is a mate - searched mates come within MAX_PLY of CHECKMATE, and a
+# tablebase mate found at the deepest ply can be ChessTablebase.MAX_PLIES further away still
+MATE_BOUND = CHECKMATE - MAX_PLY - ChessTablebase.MAX_PLIES
+CHECK_EVERY = 256  # nodes between clock and stop event checks - the node budget is checked at every node
+DEFAULT_TT_MB = 16
+EXACT, LOWERBOUND, UPPERBOUND = 0, 1, 2  # transposition table bound types
+# move ordering scores - hash move, then captures, then killers, then quiets by history
+TT_MOVE_SCORE = 1 << 30
+CAPTURE_SCORE = 1 << 24
+KILLER_SCORES = (1 << 23, 1 << 22)
+# piece values for static exchange evaluation - the king is priced so no exchange ever wins by giving it up
+SEE_VALUES = dict(ChessEvaluation.pieceScore, K=CHECKMATE)
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class TranspositionTable():
+    """
+    Fixed size hash table of search results keyed on GameState.zobristKey
+    every bucket holds two entries - a depth preferred slot that only gives way to an equal or deeper search
+    and an always replace slot - so memory is set once at construction and never grows
+    each entry is a 64 bit key plus a 64 bit word packing the move id, depth, bound type and score
+    """
+    ENTRY_BYTES = 16
+
+    def __init__(self, sizeMB=DEFAULT_TT_MB):
+        self.bucketCount = max(1, sizeMB * 1024 * 1024 // (2 * self.ENTRY_BYTES))
+        self.keys = array("Q", bytes(16 * self.bucketCount))  # 2 slots per bucket, 8 bytes each
+        self.data = array("Q", bytes(16 * self.bucketCount))
+        self.hits = 0
+        self.misses = 0
+        self.collisions = 0  # probes that found the bucket holding other positions
+
+    def clear(self):
+        self.keys = array("Q", bytes(16 * self.bucketCount))
+        self.data = array("Q", bytes(16 * self.bucketCount))
+        self.hits = self.misses = self.collisions = 0
+
+    """
+    Returns (depth, bound, score, moveID) for key, or None - moveID is 0 when no move was stored
+    """
+
+    def probe(self, key):
+        i = (key % self.bucketCount) * 2
+        keys = self.keys
+        if keys[i] == key:
+            data = self.data[i]
+        elif keys[i + 1] == key:
+            data = self.data[i + 1]
+        else:
+            self.misses += 1
+            if keys[i] or keys[i + 1]:
+                self.collisions += 1
+            return None
+        self.hits += 1
+        return (data >> 16) & 0xFF, (data >> 24) & 0x3, (data >> 32) - 0x80000000, data & 0xFFFF
+
+    def store(self, key, depth, bound, score, moveID):
+        i = (key % self.bucketCount) * 2
+        data = (score + 0x80000000) << 32 | bound << 24 | min(depth, 0xFF) << 16 | moveID
+        if self.keys[i] == key or depth >= (self.data[i] >> 16) & 0xFF or not self.keys[i]:
+            self.keys[i] = key
+            self.data[i] = data
+        else:
+            self.keys[i + 1] = key
+            self.data[i + 1] = data
+
+
+class MoveOrderer():
+    """
+    Move ordering state for one search - MVV-LVA for captures, two killer moves per ply and a history table
+    of quiet moves that caused beta cutoffs, indexed by piece and destination square
+    """
+
+    def __init__(self):
+        self.killers = [[0, 0] for _ in range(MAX_PLY + 1)]
+        self.history = [[0] * 64 for _ in ChessEngine.PIECE_CODES]
+
+    def clear(self):
+        self.killers = [[0, 0] for _ in range(MAX_PLY + 1)]
+        self.history = [[0] * 64 for _ in ChessEngine.PIECE_CODES]
+
+    """
+    Most valuable victim, least valuable attacker - promotions count the piece gained as the victim, and the
+    attacker is ranked by GameState.attackerOrder so the king comes last
+    """
+
+    @staticmethod
+    def captureScore(move):
+        victim = ChessEvaluation.pieceScore[move.pieceCaptured[1]] if move.pieceCaptured != "--" else 0
+        if move.isPawnPromotion:
+            victim += ChessEvaluation.pieceScore[move.promotionPiece] - ChessEvaluation.pieceScore["p"]
+        return CAPTURE_SCORE + victim * 16 - ChessEngine.GameState.attackerOrder[move.pieceMoved[1]]
+
+    def quietScore(self, move, ply):
+        killers = self.killers[ply]
+        if move.moveID == killers[0]:
+            return KILLER_SCORES[0]
+        if move.moveID == killers[1]:
+            return KILLER_SCORES[1]
+        return self.history[ChessEngine.PIECE_CODE_INDEX[move.pieceMoved]][move.endRow * 8 + move.endCol]
+
+    def scoreMove(self, move, ply):
+        if move.pieceCaptured != "--" or move.isPawnPromotion:
+            return self.captureScore(move)
+        return self.quietScore(move, ply)
+
+    """
+    Sort a full move list best first, e.g. the root moves
+    """
+
+    def sortMoves(self, moves, ply, ttMoveID=0):
+        moves.sort(key=lambda move: TT_MOVE_SCORE if move.moveID == ttMoveID else self.scoreMove(move, ply),
+                   reverse=True)
+        return moves
+
+    """
+    Staged move generation - yields the legal moves of gs best first, generating the quiet moves only when the
+    search asks for more moves than the captures and promotions; both stages share one pin and check scan
+    a quiet hash move has to be checked against the full move list, so it brings the quiets forward
+    """
+
+    def orderedMoves(self, gs, ply, ttMoveID=0):
+        pinsAndChecks = gs.checkForPinsAndChecks()
+        captures = gs.getValidCaptures(pinsAndChecks)
+        quiets = None
+        if ttMoveID and not any(move.moveID == ttMoveID for move in captures):
+            quiets = self._quietMoves(gs, ply, pinsAndChecks)
+            for move in quiets:
+                if move.moveID == ttMoveID:
+                    quiets.remove(move)
+                    yield move
+                    break
+        captures.sort(key=lambda move: TT_MOVE_SCORE if move.moveID == ttMoveID else self.captureScore(move),
+                      reverse=True)
+        yield from captures
+        if quiets is None:
+            quiets = self._quietMoves(gs, ply, pinsAndChecks)
+        yield from quiets
+
+    def _quietMoves(self, gs, ply, pinsAndChecks):
+        quiets = gs.getValidQuiets(pinsAndChecks)
+        quiets.sort(key=lambda move: self.quietScore(move, ply), reverse=True)
+        return quiets
+
+    """
+    Remember a quiet move that caused a beta cutoff - as a killer at its ply and in the history table
+    """
+
+    def recordCutoff(self, move, ply, depth):
+        if move.pieceCaptured != "--" or move.isPawnPromotion:
+            return
+        killers = self.killers[ply]
+        if killers[0] != move.moveID:
+            killers[1] = killers[0]
+            killers[0] = move.moveID
+        self.history[ChessEngine.PIECE_CODE_INDEX[move.pieceMoved]][move.endRow * 8 + move.endCol] += depth * depth
+
+
+class SearchResult():
+    def __init__(self, bestMove, score, pv, nodes, depth):
+        self.bestMove = bestMove
+        self.score = score  # centipawns from the side to move's point of view
+        self.pv = pv  # principal variation, starting with bestMove
+        self.nodes = nodes
+        self.depth = depth  # last depth that was searched completely
+
+
+class Searcher():
+    def __init__(self, tt=None, tablebase=None):
+        self.tt = tt if tt is not None else TranspositionTable()
+        self.tablebase = tablebase
+        self.orderer = MoveOrderer()
+        self.nodes = 0
+        self.deadline = None
+        self.nodeLimit = float("inf")  # compared at every node, unlike the clock
+        self.stopEvent = None
+        self.pvTable = [[] for _ in range(MAX_PLY + 1)]
+
+    """
+    Iterative deepening - searches depth 1, 2, 3... and returns the result of the last completed depth
+    when the deadline (timeLimitMs) or node budget (nodeLimit) runs out, or once stopEvent (a threading.Event)
+    is set from another thread
+    searchMoves restricts the root to those moves, e.g. one worker's share of a parallel root split
+    onIteration is called with the SearchResult of every completed depth
+    """
+
+    def search(self, gs, depth=None, timeLimitMs=None, nodeLimit=None, searchMoves=None, stopEvent=None,
+               onIteration=None):
+        if depth is None:
+            # with a limit or a stop event to end it the search deepens until stopped
+            limited = timeLimitMs is not None or nodeLimit is not None or stopEvent is not None
+            depth = MAX_PLY if limited else DEFAULT_DEPTH
+        self.nodes = 0
+        self.nodeLimit = nodeLimit if nodeLimit is not None else float("inf")
+        self.stopEvent = stopEvent
+        self.deadline = time.perf_counter() + timeLimitMs / 1000 if timeLimitMs is not None else None
+        self.orderer.clear()
+
+        rootMoves = gs.getValidMoves()
+        if searchMoves is not None:
+            rootMoves = [move for move in rootMoves if move in searchMoves]
+        if len(rootMoves) == 0:
+            return SearchResult(None, -CHECKMATE if gs.inCheck() else STALEMATE, [], 0, 0)
+        result = self.tablebaseRoot(gs, rootMoves)
+        if result is not None:
+            if onIteration is not None:
+                onIteration(result)
+            return result
+        entry = self.tt.probe(gs.zobristKey)
+        self.orderer.sortMoves(rootMoves, 0, entry[3] if entry is not None else 0)
+        result = SearchResult(rootMoves[0], 0, [rootMoves[0]], 0, 0)  # fallback if depth 1 never finishes
+        rootPly = len(gs.moveLog)
+        for currentDepth in range(1, min(depth, MAX_PLY) + 1):
+            # try the best move of the previous iteration first so its score is a good bound for the rest
+            if result.bestMove in rootMoves:
+                rootMoves.remove(result.bestMove)
+                rootMoves.insert(0, result.bestMove)
+            try:
+                score = self.searchRoot(gs, rootMoves, currentDepth)
+            except SearchTimeout:
+                while len(gs.moveLog) > rootPly:  # unwind whatever the aborted iteration left on the board
+                    gs.undoMove()
+                break
+            pv = list(self.pvTable[0])
+            result = SearchResult(pv[0], score, pv, self.nodes, currentDepth)
+            if onIteration is not None:
+                onIteration(result)
+            if abs(score) >= MATE_BOUND:  # forced mate found - deeper search won't change it
+                break
+        result.nodes = self.nodes
+        return result
+
+    """
+    Pick the root move straight from the tablebase when every move leads into it - the quickest win,
+    else a draw, else the slowest loss - or None when any move needs searching
+    """
+
+    def tablebaseRoot(self, gs, rootMoves):
+        if self.tablebase is None:
+            return None
+        bestMove, bestScore = None, -CHECKMATE - 1
+        for move in rootMoves:
+            gs.makeMove(move)
+            hit = self.tablebase.probe(gs)
+            gs.undoMove()
+            if hit is None:
+                return None
+            score = -tablebaseScore(hit, 1)
+            if score > bestScore:
+                bestMove, bestScore = move, score
+        return SearchResult(bestMove, bestScore, [bestMove], len(rootMoves), 1)
+
+    def searchRoot(self, gs, rootMoves, depth):
+        alpha, beta = -CHECKMATE - 1, CHECKMATE + 1
+        for move in rootMoves:
+            gs.makeMove(move)
+            score = -self.negamax(gs, depth - 1, -beta, -alpha, 1)
+            gs.undoMove()
+            if score > alpha:
+                alpha = score
+                self.pvTable[0] = [move] + self.pvTable[1]
+        return alpha
+
+    """
+    What every negamax and quiescence node starts with - counts it against the node limit, checks the clock
+    and the stop event every CHECK_EVERY nodes and clears its PV, then probes the tablebase
+    returns the tablebase score, or None when the position has to be searched
+    """
+
+    def enterNode(self, gs, ply):
+        if self.nodes >= self.nodeLimit:
+            raise SearchTimeout()
+        self.nodes += 1
+        if self.nodes % CHECK_EVERY == 0:
+            self.checkLimits()
+        self.pvTable[ply] = []  # a tablebase hit ends the line here
+        if self.tablebase is not None:
+            hit = self.tablebase.probe(gs)
+            if hit is not None:
+                return tablebaseScore(hit, ply)
+        return None
+
+    def negamax(self, gs, depth, alpha, beta, ply):
+        if depth <= 0:
+            return self.quiescence(gs, alpha, beta, ply)
+        score = self.enterNode(gs, ply)
+        if score is not None:
+            return score
+        key = gs.zobristKey
+        ttMoveID = 0
+        entry = self.tt.probe(key)
+        if entry is not None:
+            ttDepth, bound, ttScore, ttMoveID = entry
+            if ttDepth >= depth:
+                ttScore = scoreFromTT(ttScore, ply)
+                if bound == EXACT or (bound == LOWERBOUND and ttScore >= beta) or \
+                        (bound == UPPERBOUND and ttScore <= alpha):
+                    return ttScore
+        if ply >= MAX_PLY:
+            return evaluate(gs)
+        originalAlpha = alpha
+        bestScore = -CHECKMATE - 1
+        bestMoveID = 0
+        for move in self.orderer.orderedMoves(gs, ply, ttMoveID):
+            gs.makeMove(move)
+            score = -self.negamax(gs, depth - 1, -beta, -alpha, ply + 1)
+            gs.undoMove()
+            if score > bestScore:
+                bestScore = score
+                bestMoveID = move.moveID
+            if score >= beta:
+                self.orderer.recordCutoff(move, ply, depth)
+                self.tt.store(key, depth, LOWERBOUND, scoreToTT(score, ply), move.moveID)
+                return score  # fail soft beta cutoff
+            if score > alpha:
+                alpha = score
+                self.pvTable[ply] = [move] + self.pvTable[ply + 1]
+        if bestMoveID == 0:
+            # no legal moves - prefer the quickest mate and the slowest loss
+            return -CHECKMATE + ply if gs.inCheck() else STALEMATE
+        bound = EXACT if alpha > originalAlpha else UPPERBOUND
+        self.tt.store(key, depth, bound, scoreToTT(bestScore, ply), bestMoveID)
+        return bestScore
+
+    """
+    Capture only search below the horizon, so leaves aren't scored in the middle of an exchange - the side to
+    move may stand pat on the static evaluation, and captures that lose material by static exchange evaluation
+    are not searched; in check every evasion is searched instead, which also finds mates at the leaves
+    """
+
+    def quiescence(self, gs, alpha, beta, ply):
+        score = self.enterNode(gs, ply)
+        if score is not None:
+            return score
+        if ply >= MAX_PLY:
+            return evaluate(gs)
+        if gs.inCheck():
+            bestScore = -CHECKMATE + ply  # mated unless an evasion is found
+            moves = self.orderer.orderedMoves(gs, ply)
+        else:
+            bestScore = evaluate(gs)  # stand pat
+            if bestScore >= beta:
+                return bestScore
+            alpha = max(alpha, bestScore)
+            moves = [move for move in self.orderer.sortMoves(gs.getValidCaptures(), ply)
+                     if move.isPawnPromotion or gs.staticExchange(move, SEE_VALUES) >= 0]
+        for move in moves:
+            gs.makeMove(move)
+            score = -self.quiescence(gs, -beta, -alpha, ply + 1)
+            gs.undoMove()
+            if score > bestScore:
+                bestScore = score
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+                self.pvTable[ply] = [move] + self.pvTable[ply + 1]
+        return bestScore
+
+    def checkLimits(self):
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            raise SearchTimeout()
+        if self.stopEvent is not None and self.stopEvent.is_set():
+            raise SearchTimeout()
+
+
+"""
+Mate scores are stored relative to the node instead of the root, so a stored mate stays correct
+when the same position is reached at a different ply
+"""
+
+
+def scoreToTT(score, ply):
+    if score >= MATE_BOUND:
+        return score + ply
+    if score <= -MATE_BOUND:
+        return score - ply
+    return score
+
+
+def scoreFromTT(score, ply):
+    if score >= MATE_BOUND:
+        return score - ply
+    if score <= -MATE_BOUND:
+        return score + ply
+    return score
+
+
+"""
+Tablebase (WIN / DRAW / LOSS, plies to mate) as a search score at ply, on the same scale as the mate scores
+"""
+
+
+def tablebaseScore(hit, ply):
+    value, plies = hit
+    if value > 0:
+        return CHECKMATE - ply - plies
+    if value < 0:
+        return -CHECKMATE + ply + plies
+    return STALEMATE
+
+
+"""
+Search gs and return a SearchResult - stops at depth, after timeLimitMs milliseconds or after nodeLimit nodes,
+whichever comes first; when an opening book is given a book move is played without searching, and with a
+tablebase the positions it covers are answered from it
+"""
+
+
+def findBestMove(gs, depth=None, timeLimitMs=None, nodeLimit=None, tt=None, book=None, tablebase=None):
+    if book is not None:
+        move = book.chooseMove(gs)
+        if move is not None:
+            return SearchResult(move, 0, [move], 0, 0)
+    return Searcher(tt, tablebase).search(gs, depth, timeLimitMs, nodeLimit)
+
+
+"""
+Static evaluation from the point of view of the side to move
+"""
+
+
+def evaluate(gs):
+    score = ChessEvaluation.evaluate(gs)
+    return score if gs.whiteToMove else -score
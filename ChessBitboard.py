@@ -0,0 +1,417 @@
+"""
+bitboard backed GameState - stores the position as twelve 64 bit piece bitboards plus occupancy masks
+moves are generated from precomputed knight, king and pawn attack tables and sliding ray masks
+the 8x8 board grid is still kept in sync so ChessMain.drawPieces keeps working
+"""
+import ChessEngine
+
+# square index = row * 8 + col, so row 0 (rank 8) holds squares 0-7 and a8 is square 0
+PIECES = ["wp", "wN", "wB", "wR", "wQ", "wK", "bp", "bN", "bB", "bR", "bQ", "bK"]
+PIECE_INDEX = {piece: i for i, piece in enumerate(PIECES)}
+WHITE, BLACK = 0, 1
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = 0, 1, 2, 3, 4, 5
+
+"""
+Attack tables - built once when the module is imported
+"""
+
+
+def _stepAttacks(steps):
+    table = []
+    for sq in range(64):
+        row, col = divmod(sq, 8)
+        mask = 0
+        for dr, dc in steps:
+            r, c = row + dr, col + dc
+            if 0 <= r < 8 and 0 <= c < 8:
+                mask |= 1 << (r * 8 + c)
+        table.append(mask)
+    return table
+
+
+KNIGHT_ATTACKS = _stepAttacks([(-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)])
+KING_ATTACKS = _stepAttacks([(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)])
+# PAWN_ATTACKS[color][sq] - squares a pawn of that color standing on sq attacks
+PAWN_ATTACKS = [_stepAttacks([(-1, -1), (-1, 1)]), _stepAttacks([(1, -1), (1, 1)])]
+
+# ray directions as (row step, col step); positive rays run towards higher square indexes
+ROOK_DIRECTIONS = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+BISHOP_DIRECTIONS = [(-1, -1), (-1, 1), (1, -1), (1, 1)]
+
+
+def _rays(direction):
+    dr, dc = direction
+    table = []
+    for sq in range(64):
+        row, col = divmod(sq, 8)
+        mask = 0
+        r, c = row + dr, col + dc
+        while 0 <= r < 8 and 0 <= c < 8:
+            mask |= 1 << (r * 8 + c)
+            r, c = r + dr, c + dc
+        table.append(mask)
+    return table
+
+
+# each entry is (ray table, True if the ray runs towards higher square indexes)
+ROOK_RAYS = [(_rays(d), d[0] * 8 + d[1] > 0) for d in ROOK_DIRECTIONS]
+BISHOP_RAYS = [(_rays(d), d[0] * 8 + d[1] > 0) for d in BISHOP_DIRECTIONS]
+
+
+def _slidingAttacks(sq, occupied, rays):
+    attacks = 0
+    for table, positive in rays:
+        ray = table[sq]
+        blockers = ray & occupied
+        if blockers:
+            # the nearest blocker is the lowest set bit on a positive ray and the highest on a negative one
+            if positive:
+                blocker = (blockers & -blockers).bit_length() - 1
+            else:
+                blocker = blockers.bit_length() - 1
+            ray ^= table[blocker]
+        attacks |= ray
+    return attacks
+
+
+def rookAttacks(sq, occupied):
+    return _slidingAttacks(sq, occupied, ROOK_RAYS)
+
+
+def bishopAttacks(sq, occupied):
+    return _slidingAttacks(sq, occupied, BISHOP_RAYS)
+
+
+# (row, col) of every square index
+SQUARE_COORDS = [divmod(sq, 8) for sq in range(64)]
+
+
+def bitSquares(bb):
+    """yields the index of every set bit, lowest first"""
+    while bb:
+        lsb = bb & -bb
+        yield lsb.bit_length() - 1
+        bb ^= lsb
+
+
+class BitboardGameState(ChessEngine.GameState):
+    def __init__(self):
+        super().__init__()
+        self.bitboards = [0] * 12  # one bitboard per piece in PIECES order
+        self.colorOccupancy = [0, 0]  # white pieces, black pieces
+        self.occupied = 0
+        self.loadBoard()
+
+    """
+    Rebuild every bitboard from the board grid
+    """
+
+    def loadBoard(self):
+        self.bitboards = [0] * 12
+        for row in range(8):
+            for col in range(8):
+                piece = self.board[row][col]
+                if piece != "--":
+                    self.bitboards[PIECE_INDEX[piece]] |= 1 << (row * 8 + col)
+        self.colorOccupancy = [0, 0]
+        for i in range(6):
+            self.colorOccupancy[WHITE] |= self.bitboards[i]
+            self.colorOccupancy[BLACK] |= self.bitboards[i + 6]
+        self.occupied = self.colorOccupancy[WHITE] | self.colorOccupancy[BLACK]
+
+    def _setPosition(self, *position):
+        super()._setPosition(*position)
+        self.loadBoard()
+
+    def _togglePiece(self, piece, sq):
+        mask = 1 << sq
+        self.bitboards[PIECE_INDEX[piece]] ^= mask
+        self.colorOccupancy[WHITE if piece[0] == "w" else BLACK] ^= mask
+        self.occupied ^= mask
+
+    def makeMove(self, move):
+        super().makeMove(move)
+        startSq = move.startRow * 8 + move.startCol
+        endSq = move.endRow * 8 + move.endCol
+        self._togglePiece(move.pieceMoved, startSq)
+        if move.isEnpassantMove:
+            self._togglePiece(move.pieceCaptured, move.startRow * 8 + move.endCol)
+        elif move.pieceCaptured != "--":
+            self._togglePiece(move.pieceCaptured, endSq)
+        self._togglePiece(self.board[move.endRow][move.endCol], endSq)  # promoted piece if it promoted
+        if move.isCastleMove:
+            self._toggleCastleRook(move)
+
+    def _toggleCastleRook(self, move):
+        rook = move.pieceMoved[0] + "R"
+        if move.endCol - move.startCol == 2:  # king side
+            rookFrom, rookTo = move.endCol + 1, move.endCol - 1
+        else:  # queen side
+            rookFrom, rookTo = move.endCol - 2, move.endCol + 1
+        self._togglePiece(rook, move.endRow * 8 + rookFrom)
+        self._togglePiece(rook, move.endRow * 8 + rookTo)
+
+    def undoMove(self):
+        if len(self.moveLog) > 0:
+            move = self.moveLog[-1]
+            startSq = move.startRow * 8 + move.startCol
+            endSq = move.endRow * 8 + move.endCol
+            if move.isCastleMove:
+                self._toggleCastleRook(move)
+            self._togglePiece(self.board[move.endRow][move.endCol], endSq)
+            if move.isEnpassantMove:
+                self._togglePiece(move.pieceCaptured, move.startRow * 8 + move.endCol)
+            elif move.pieceCaptured != "--":
+                self._togglePiece(move.pieceCaptured, endSq)
+            self._togglePiece(move.pieceMoved, startSq)
+            super().undoMove()
+
+    """
+    Determine if the current player is in check - the king is read off its bitboard
+    """
+
+    def inCheck(self):
+        color = WHITE if self.whiteToMove else BLACK
+        king = self.bitboards[color * 6 + KING]
+        if not king:
+            return False
+        return self.isSquareAttacked(king.bit_length() - 1, 1 - color)
+
+    """
+    Pins and checks on the current player's king in the same form as GameState.checkForPinsAndChecks - each ray
+    from the king is cut at its first and second blockers instead of being walked square by square
+    """
+
+    def checkForPinsAndChecks(self):
+        pins = {}
+        checks = []
+        color = WHITE if self.whiteToMove else BLACK
+        enemy = 1 - color
+        bb = self.bitboards
+        king = bb[color * 6 + KING]
+        kingSq = king.bit_length() - 1
+        occupied = self.occupied
+        allies = self.colorOccupancy[color]
+        queens = bb[enemy * 6 + QUEEN]
+        for rays, directions, sliders in ((ROOK_RAYS, ROOK_DIRECTIONS, bb[enemy * 6 + ROOK] | queens),
+                                          (BISHOP_RAYS, BISHOP_DIRECTIONS, bb[enemy * 6 + BISHOP] | queens)):
+            for (table, positive), direction in zip(rays, directions):
+                blockers = table[kingSq] & occupied
+                if not blockers:
+                    continue
+                first = (blockers & -blockers).bit_length() - 1 if positive else blockers.bit_length() - 1
+                if not allies >> first & 1:
+                    if sliders >> first & 1:
+                        checks.append((first // 8, first % 8, direction))
+                    continue
+                beyond = table[first] & occupied
+                if not beyond:
+                    continue
+                second = (beyond & -beyond).bit_length() - 1 if positive else beyond.bit_length() - 1
+                if sliders >> second & 1:
+                    pins[divmod(first, 8)] = direction
+        leapers = (KNIGHT_ATTACKS[kingSq] & bb[enemy * 6 + KNIGHT]) | \
+                  (PAWN_ATTACKS[color][kingSq] & bb[enemy * 6 + PAWN])
+        for sq in bitSquares(leapers):
+            checks.append((sq // 8, sq % 8, None))
+        return pins, checks
+
+    def _kingMoveIsSafe(self, move, enemyColor):
+        startSq = move.startRow * 8 + move.startCol
+        self._togglePiece(move.pieceMoved, startSq)
+        safe = not self.squareAttackedBy(move.endRow, move.endCol, enemyColor)
+        self._togglePiece(move.pieceMoved, startSq)
+        return safe
+
+    def _enpassantExposesKing(self, move, kingRow, kingCol, enemyColor):
+        startSq = move.startRow * 8 + move.startCol
+        capturedSq = move.startRow * 8 + move.endCol
+        endSq = move.endRow * 8 + move.endCol
+        self._togglePiece(move.pieceMoved, startSq)
+        self._togglePiece(move.pieceCaptured, capturedSq)
+        self._togglePiece(move.pieceMoved, endSq)
+        exposed = self.squareAttackedBy(kingRow, kingCol, enemyColor)
+        self._togglePiece(move.pieceMoved, endSq)
+        self._togglePiece(move.pieceCaptured, capturedSq)
+        self._togglePiece(move.pieceMoved, startSq)
+        return exposed
+
+    """
+    Determine if any piece of the given color attacks the square r, c
+    """
+
+    def squareAttackedBy(self, r, c, color):
+        return self.isSquareAttacked(r * 8 + c, WHITE if color == "w" else BLACK)
+
+    """
+    Every piece of the given color (the enemy by default) that attacks the square r, c as a list of (row, col)
+    """
+
+    def getAttackers(self, r, c, color=None):
+        if color is None:
+            byColor = BLACK if self.whiteToMove else WHITE
+        else:
+            byColor = WHITE if color == "w" else BLACK
+        return [divmod(sq, 8) for sq in bitSquares(self.attackersTo(r * 8 + c, byColor))]
+
+    """
+    Determine if any piece of byColor attacks sq - looks outward from sq using the attack tables
+    """
+
+    def isSquareAttacked(self, sq, byColor):
+        bb = self.bitboards
+        base = byColor * 6
+        # a pawn of byColor attacks sq if a pawn of the other color on sq would attack it back
+        if PAWN_ATTACKS[1 - byColor][sq] & bb[base + PAWN]:
+            return True
+        if KNIGHT_ATTACKS[sq] & bb[base + KNIGHT]:
+            return True
+        if KING_ATTACKS[sq] & bb[base + KING]:
+            return True
+        queens = bb[base + QUEEN]
+        if rookAttacks(sq, self.occupied) & (bb[base + ROOK] | queens):
+            return True
+        if bishopAttacks(sq, self.occupied) & (bb[base + BISHOP] | queens):
+            return True
+        return False
+
+    """
+    Bitboard of every piece of byColor attacking sq
+    """
+
+    def attackersTo(self, sq, byColor):
+        bb = self.bitboards
+        base = byColor * 6
+        queens = bb[base + QUEEN]
+        return (PAWN_ATTACKS[1 - byColor][sq] & bb[base + PAWN]) | \
+               (KNIGHT_ATTACKS[sq] & bb[base + KNIGHT]) | \
+               (KING_ATTACKS[sq] & bb[base + KING]) | \
+               (rookAttacks(sq, self.occupied) & (bb[base + ROOK] | queens)) | \
+               (bishopAttacks(sq, self.occupied) & (bb[base + BISHOP] | queens))
+
+    """
+    The cheapest piece of color attacking the square r, c as (row, col, piece type), ignoring the squares in
+    removed - sliders are looked up through an occupancy with the removed squares cleared
+    """
+
+    def _leastValuableAttacker(self, r, c, color, removed):
+        removedMask = 0
+        for row, col in removed:
+            removedMask |= 1 << (row * 8 + col)
+        occupied = self.occupied & ~removedMask
+        sq = r * 8 + c
+        byColor = WHITE if color == "w" else BLACK
+        bb = self.bitboards
+        base = byColor * 6
+        rooks = rookAttacks(sq, occupied)
+        bishops = bishopAttacks(sq, occupied)
+        for pieceType, attacks in ((PAWN, PAWN_ATTACKS[1 - byColor][sq]), (KNIGHT, KNIGHT_ATTACKS[sq]),
+                                   (BISHOP, bishops), (ROOK, rooks), (QUEEN, rooks | bishops),
+                                   (KING, KING_ATTACKS[sq])):
+            attackers = attacks & bb[base + pieceType] & occupied
+            if attackers:
+                attacker = (attackers & -attackers).bit_length() - 1
+                return attacker // 8, attacker % 8, PIECES[base + pieceType][1]
+        return None
+
+    """
+    All moves without considering checks
+    """
+
+    def getAllPossibleMoves(self):
+        return self._generateMoves(True, True)
+
+    """
+    Captures, en passant and promotions without considering checks - the attack masks are cut down
+    to enemy pieces so no quiet moves are built
+    """
+
+    def getCaptureMoves(self):
+        return self._generateMoves(True, False)
+
+    """
+    Moves that neither capture nor promote, without considering checks or castling - the attack masks are
+    cut down to empty squares
+    """
+
+    def getQuietMoves(self):
+        return self._generateMoves(False, True)
+
+    def _generateMoves(self, captures, quiets):
+        moves = []
+        color = WHITE if self.whiteToMove else BLACK
+        base = color * 6
+        bb = self.bitboards
+        targets = 0
+        if captures:
+            targets |= self.colorOccupancy[1 - color]
+        if quiets:
+            targets |= ~self.occupied
+        occupied = self.occupied
+
+        self._addPawnMoves(color, moves, captures, quiets)
+        for sq in bitSquares(bb[base + KNIGHT]):
+            self._addMoves(sq, PIECES[base + KNIGHT], KNIGHT_ATTACKS[sq] & targets, moves)
+        for sq in bitSquares(bb[base + BISHOP]):
+            self._addMoves(sq, PIECES[base + BISHOP], bishopAttacks(sq, occupied) & targets, moves)
+        for sq in bitSquares(bb[base + ROOK]):
+            self._addMoves(sq, PIECES[base + ROOK], rookAttacks(sq, occupied) & targets, moves)
+        for sq in bitSquares(bb[base + QUEEN]):
+            attacks = rookAttacks(sq, occupied) | bishopAttacks(sq, occupied)
+            self._addMoves(sq, PIECES[base + QUEEN], attacks & targets, moves)
+        for sq in bitSquares(bb[base + KING]):
+            self._addMoves(sq, PIECES[base + KING], KING_ATTACKS[sq] & targets, moves)
+        return moves
+
+    def _addMoves(self, sq, piece, targets, moves):
+        # the set bits are walked inline - this runs for every piece of every generated position
+        start = SQUARE_COORDS[sq]
+        Move = ChessEngine.Move
+        quiet = targets & ~self.occupied
+        while quiet:
+            lsb = quiet & -quiet
+            moves.append(Move(start, SQUARE_COORDS[lsb.bit_length() - 1], piece))
+            quiet ^= lsb
+        captures = targets & self.occupied
+        board = self.board
+        while captures:
+            lsb = captures & -captures
+            end = SQUARE_COORDS[lsb.bit_length() - 1]
+            moves.append(Move(start, end, piece, board[end[0]][end[1]]))
+            captures ^= lsb
+
+    def _addPawnMoves(self, color, moves, captures=True, quiets=True):
+        empty = ~self.occupied
+        enemies = self.colorOccupancy[1 - color]
+        if self.enpassantPossible:
+            epSquare = 1 << (self.enpassantPossible[0] * 8 + self.enpassantPossible[1])
+        else:
+            epSquare = 0
+        step = -8 if color == WHITE else 8
+        startRow = 6 if color == WHITE else 1
+        piece = PIECES[color * 6 + PAWN]
+        promotionRow = 1 if color == WHITE else 6
+        for sq in bitSquares(self.bitboards[color * 6 + PAWN]):
+            start = divmod(sq, 8)
+            first = len(moves)
+            oneStep = sq + step
+            promotes = start[0] == promotionRow  # promotions, pushes included, are generated with the captures
+            if empty >> oneStep & 1 and (captures if promotes else quiets):  # 1 square pawn advance
+                moves.append(ChessEngine.Move(start, divmod(oneStep, 8), piece))
+                twoStep = oneStep + step
+                if start[0] == startRow and empty >> twoStep & 1 and quiets:  # 2 square pawn advance
+                    moves.append(ChessEngine.Move(start, divmod(twoStep, 8), piece))
+            if not captures:
+                continue
+            attacks = PAWN_ATTACKS[color][sq]
+            for endSq in bitSquares(attacks & enemies):
+                end = divmod(endSq, 8)
+                moves.append(ChessEngine.Move(start, end, piece, self.board[end[0]][end[1]]))
+            if attacks & epSquare:
+                moves.append(ChessEngine.Move(start, self.enpassantPossible, piece, "--", True))
+            if promotes:  # every move from here promotes - add the under promotions
+                for i in range(first, len(moves)):
+                    move = moves[i]
+                    for promotionPiece in ("R", "B", "N"):
+                        moves.append(ChessEngine.Move(start, (move.endRow, move.endCol), piece, move.pieceCaptured,
+                                                      promotionPiece=promotionPiece))
@@ -0,0 +1,129 @@
+"""
+opening book - a sorted binary file of (position key, move, weight) entries built from a set of games
+at runtime the file is opened with mmap and binary searched, so every engine process on a host shares the
+one page cache copy instead of loading its own
+
+    python ChessBook.py games.pgn more.pgn --out book.bin --max-ply 20
+"""
+import argparse
+import mmap
+import random
+import struct
+import sys
+
+import ChessPGN
+
+# GameState.zobristKey, Move.moveID, times the move was played - keys come from a fixed seed so they
+# are the same in every process that reads the book
+ENTRY = struct.Struct(">QHH")
+ENTRY_BYTES = ENTRY.size
+MAX_WEIGHT = 0xFFFF
+
+
+"""
+Count every (position, move) pair in the first maxPly plies of the games in pgnPaths and write the sorted
+book to outPath - returns the number of entries written
+games that stop early on a bad move keep the moves before it, and are reported to log when given
+"""
+
+
+def buildBook(pgnPaths, outPath, maxPly=20, minCount=1, log=None):
+    counts = {}
+    for path in pgnPaths:
+        # games are only replayed as far as the book goes
+        for game, gs in ChessPGN.replayFile(path, yieldPositions=True, maxPly=maxPly):
+            if isinstance(gs, ChessPGN.GameSummary):  # end of the game
+                if gs.error is not None and log is not None:
+                    print("%s: %s - %s" % (path, _gameName(game), gs.error), file=log)
+                continue
+            entry = (gs.zobristLog[-2], gs.moveLog[-1].moveID)  # the position before the move, and the move
+            counts[entry] = counts.get(entry, 0) + 1
+    entries = sorted((key, moveID, min(count, MAX_WEIGHT)) for (key, moveID), count in counts.items()
+                     if count >= minCount)
+    with open(outPath, "wb") as f:
+        for entry in entries:
+            f.write(ENTRY.pack(*entry))
+    return len(entries)
+
+
+def _gameName(game):
+    return "%s - %s" % (game.tags.get("White", "?"), game.tags.get("Black", "?"))
+
+
+class OpeningBook():
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        try:
+            self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty book
+            self.mm = b""
+        self.entryCount = len(self.mm) // ENTRY_BYTES
+
+    def close(self):
+        if isinstance(self.mm, mmap.mmap):
+            self.mm.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    """
+    (moveID, weight) for every book move stored under key - binary search for the first entry with the key
+    """
+
+    def lookup(self, key):
+        lo, hi = 0, self.entryCount
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if ENTRY.unpack_from(self.mm, mid * ENTRY_BYTES)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        found = []
+        while lo < self.entryCount:
+            entryKey, moveID, weight = ENTRY.unpack_from(self.mm, lo * ENTRY_BYTES)
+            if entryKey != key:
+                break
+            found.append((moveID, weight))
+            lo += 1
+        return found
+
+    """
+    Book moves for gs as a list of (Move, weight), resolved against its legal moves
+    """
+
+    def probe(self, gs):
+        found = self.lookup(gs.zobristKey)
+        if not found:
+            return []
+        validMoves = {move.moveID: move for move in gs.getValidMoves()}
+        return [(validMoves[moveID], weight) for moveID, weight in found if moveID in validMoves]
+
+    """
+    A book move for gs picked at random in proportion to its weight, or None when the position isn't in the book
+    """
+
+    def chooseMove(self, gs, rng=random):
+        moves = self.probe(gs)
+        if not moves:
+            return None
+        return rng.choices([move for move, _ in moves], weights=[weight for _, weight in moves])[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="build an opening book from PGN files")
+    parser.add_argument("pgn", nargs="+")
+    parser.add_argument("--out", required=True)
+    parser.add_argument("--max-ply", type=int, default=20, help="only book moves this early in the game")
+    parser.add_argument("--min-count", type=int, default=1, help="drop moves played fewer times than this")
+    args = parser.parse_args(argv)
+    count = buildBook(args.pgn, args.out, args.max_ply, args.min_count, sys.stderr)
+    print("%d entries written to %s" % (count, args.out))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
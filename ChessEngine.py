@@ -2,9 +2,40 @@
 store info about current game state of the chess game
 also determines the valid moves at the current state. Keeps a move log
 """
+import random
+import struct
+
+
+"""
+Zobrist keys - one random 64 bit number per piece per square, plus keys for the side to move,
+each castling right and the file of the en passant square
+a fixed seed keeps the keys identical across runs and processes
+"""
+_zobristRandom = random.Random(0x5EED)
+ZOBRIST_PIECES = {color + pieceType: [_zobristRandom.getrandbits(64) for _ in range(64)]
+                  for color in "wb" for pieceType in "pNBRQK"}
+ZOBRIST_BLACK_TO_MOVE = _zobristRandom.getrandbits(64)
+ZOBRIST_CASTLING = [_zobristRandom.getrandbits(64) for _ in range(4)]  # wks, bks, wqs, bqs
+ZOBRIST_ENPASSANT = [_zobristRandom.getrandbits(64) for _ in range(8)]
+
+"""
+Binary position layout - 32 bytes, big endian:
+occupancy bitboard (8 bytes, bit row * 8 + col), one 4 bit piece code per occupied square in board order
+(16 bytes), flags (side to move and castling rights), en passant file + 1 (0 = none), halfmove clock,
+fullmove number (2 bytes) and 3 reserved zero bytes
+"""
+POSITION_STRUCT = struct.Struct(">Q16sBBBH3x")
+POSITION_BYTES = POSITION_STRUCT.size
+PIECE_CODES = ["wp", "wN", "wB", "wR", "wQ", "wK", "bp", "bN", "bB", "bR", "bQ", "bK"]
+PIECE_CODE_INDEX = {piece: i for i, piece in enumerate(PIECE_CODES)}
 
 
 class GameState():
+    # orthogonal directions first, then diagonals
+    rayDirections = ((-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+    knightOffsets = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+    attackerOrder = {"p": 0, "N": 1, "B": 2, "R": 3, "Q": 4, "K": 5}  # cheapest first, for static exchanges
+
     def __init__(self):
         # Board is an 8x8 2D list - each element has 2 chars
         # 1st char represents the color(black, white) and the 2nd char represents the type: Q, K, B, N, R, p
@@ -21,40 +52,93 @@ class GameState():
         ]
         self.whiteToMove = True
         self.moveLog = []
-        self.moveFunctions = {"p": self.getPawnMoves, "R": self.getRookMoves, "N": self.getKnightMoves,
-                              "B": self.getBishopMoves, "Q": self.getQueenMoves, "K": self.getKingMoves}
+        self._initState()
         self.whiteKingLocation = (7, 4)
         self.blackKingLocation = (0, 4)
         self.checkMate = False
         self.staleMate = False
 
         self.enpassantPossible = () #coordinate for the square where en passant is possible
+        self.enpassantPossibleLog = [self.enpassantPossible]
+        self.currentCastlingRight = CastleRights(True, True, True, True)
+        self.castleRightsLog = [self.currentCastlingRight.copy()]
+        self.halfmoveClock = 0  # plies since the last capture or pawn move, for the fifty move rule
+        self.halfmoveClockLog = [self.halfmoveClock]
+        self.fullmoveNumber = 1
+        # position key, kept up to date by makeMove/undoMove - zobristLog holds the key of every position played
+        self.zobristKey = self.computeZobristKey()
+        self.zobristLog = [self.zobristKey]
+
+    """
+    The fields that don't depend on the position - set up by __init__, and by fromFen/fromBinary, which skip
+    building the start position only to replace it
+    """
+
+    def _initState(self):
+        self.moveFunctions = {"p": self.getPawnMoves, "R": self.getRookMoves, "N": self.getKnightMoves,
+                              "B": self.getBishopMoves, "Q": self.getQueenMoves, "K": self.getKingMoves}
 
     def makeMove(self, move):
         self.board[move.startRow][move.startCol] = "--"
         self.board[move.endRow][move.endCol] = move.pieceMoved
         self.moveLog.append(move)  # log the move so we can undo it if we want
+        if move.pieceMoved[1] == "p" or move.pieceCaptured != "--":
+            self.halfmoveClock = 0
+        else:
+            self.halfmoveClock += 1
+        self.halfmoveClockLog.append(self.halfmoveClock)
+        if not self.whiteToMove:
+            self.fullmoveNumber += 1
         # update king's location if moved
         if move.pieceMoved == "wK":
             self.whiteKingLocation = (move.endRow, move.endCol)
         elif move.pieceMoved == "bK":
-            self.whiteKingLocation = (move.endRow, move.endCol)
+            self.blackKingLocation = (move.endRow, move.endCol)
         self.whiteToMove = not self.whiteToMove  # swap players
 
+        key = self.zobristKey ^ ZOBRIST_BLACK_TO_MOVE ^ \
+            ZOBRIST_PIECES[move.pieceMoved][move.startRow * 8 + move.startCol]
+
         #pawn promotion
         if move.isPawnPromotion:
-            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + "Q"
+            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + move.promotionPiece
+        key ^= ZOBRIST_PIECES[self.board[move.endRow][move.endCol]][move.endRow * 8 + move.endCol]
+
+        #castle move - the king has moved two squares, bring the rook across it
+        if move.isCastleMove:
+            if move.endCol - move.startCol == 2:  # king side
+                rookFrom, rookTo = move.endCol + 1, move.endCol - 1
+            else:  # queen side
+                rookFrom, rookTo = move.endCol - 2, move.endCol + 1
+            rook = self.board[move.endRow][rookFrom]
+            self.board[move.endRow][rookTo] = rook
+            self.board[move.endRow][rookFrom] = "--"
+            key ^= ZOBRIST_PIECES[rook][move.endRow * 8 + rookFrom] ^ ZOBRIST_PIECES[rook][move.endRow * 8 + rookTo]
 
         if move.isEnpassantMove:
             self.board[move.startRow][move.endCol] = "--"  # capturing the pawn
+            key ^= ZOBRIST_PIECES[move.pieceCaptured][move.startRow * 8 + move.endCol]
+        elif move.pieceCaptured != "--":
+            key ^= ZOBRIST_PIECES[move.pieceCaptured][move.endRow * 8 + move.endCol]
 
         #update enpassantPossible var
+        if self.enpassantPossible:
+            key ^= ZOBRIST_ENPASSANT[self.enpassantPossible[1]]
         if move.pieceMoved[1] == "p" and abs(move.startRow - move.endRow) == 2:  # only on 2 square pawn advances where u will update it
             self.enpassantPossible = ((move.startRow + move.endRow) // 2, move.startCol)
+            key ^= ZOBRIST_ENPASSANT[move.startCol]
         else:
             self.enpassantPossible = ()
+        self.enpassantPossibleLog.append(self.enpassantPossible)
 
+        #update castling rights - whenever it is a rook or a king move, or a rook is captured
+        key ^= self.currentCastlingRight.zobristKey()
+        self.updateCastleRights(move)
+        key ^= self.currentCastlingRight.zobristKey()
+        self.castleRightsLog.append(self.currentCastlingRight.copy())
 
+        self.zobristKey = key
+        self.zobristLog.append(key)
 
     def undoMove(self):
         if len(self.moveLog) > 0:
@@ -62,51 +146,392 @@ class GameState():
             self.board[move.startRow][move.startCol] = move.pieceMoved
             self.board[move.endRow][move.endCol] = move.pieceCaptured
             self.whiteToMove = not self.whiteToMove  # switch turns back
+            self.halfmoveClockLog.pop()
+            self.halfmoveClock = self.halfmoveClockLog[-1]
+            if not self.whiteToMove:
+                self.fullmoveNumber -= 1
             # update king's location if moved
             if move.pieceMoved == "wK":
-                self.whiteKingLocation = (move.endRow, move.endCol)
+                self.whiteKingLocation = (move.startRow, move.startCol)
             elif move.pieceMoved == "bK":
-                self.whiteKingLocation = (move.endRow, move.endCol)
+                self.blackKingLocation = (move.startRow, move.startCol)
             # undo en passant
             if move.isEnpassantMove:
                 self.board[move.endRow][move.endCol] = "--"
                 self.board[move.startRow][move.endCol] = move.pieceCaptured
-                self.enpassantPossible = (move.endRow, move.endCol)
-            #undo a 2 square pawn advance
-            if move.pieceMoved[1] == "p" and abs(move.startRow - move.endRow) == 2:
-                self.enpassantPossible = ()
+            # undo castle move
+            if move.isCastleMove:
+                if move.endCol - move.startCol == 2:  # king side
+                    self.board[move.endRow][move.endCol + 1] = self.board[move.endRow][move.endCol - 1]
+                    self.board[move.endRow][move.endCol - 1] = "--"
+                else:  # queen side
+                    self.board[move.endRow][move.endCol - 2] = self.board[move.endRow][move.endCol + 1]
+                    self.board[move.endRow][move.endCol + 1] = "--"
+            self.enpassantPossibleLog.pop()
+            self.enpassantPossible = self.enpassantPossibleLog[-1]
+            # undo castling rights
+            self.castleRightsLog.pop()
+            self.currentCastlingRight = self.castleRightsLog[-1].copy()
+            self.zobristLog.pop()
+            self.zobristKey = self.zobristLog[-1]
+
+    """
+    Build a GameState (or subclass) from a FEN string / from the 32 byte binary form made by toBinary
+    """
+
+    @classmethod
+    def fromFen(cls, fen):
+        gs = cls.__new__(cls)  # the loader sets every position field itself
+        gs._initState()
+        gs.loadFen(fen)
+        return gs
+
+    @classmethod
+    def fromBinary(cls, data):
+        gs = cls.__new__(cls)
+        gs._initState()
+        gs.loadBinary(data)
+        return gs
+
+    """
+    Set up the position described by a FEN string - the move clocks are optional and default to 0 and 1
+    """
+
+    def loadFen(self, fen):
+        fields = fen.split()
+        ranks = fields[0].split("/") if fields else []
+        if len(fields) < 4 or len(ranks) != 8:
+            raise ValueError("invalid FEN: " + fen)
+        board = []
+        for rank in ranks:
+            row = []
+            for ch in rank:
+                if ch.isdigit():
+                    row.extend(["--"] * int(ch))
+                elif ch in "pnbrqkPNBRQK":
+                    row.append(("w" if ch.isupper() else "b") + ("p" if ch in "Pp" else ch.upper()))
+                else:
+                    raise ValueError("invalid FEN: " + fen)
+            if len(row) != 8:
+                raise ValueError("invalid FEN: " + fen)
+            board.append(row)
+        castleRights = CastleRights("K" in fields[2], "k" in fields[2], "Q" in fields[2], "q" in fields[2])
+        if fields[3] == "-":
+            enpassantPossible = ()
+        else:
+            enpassantPossible = (Move.ranksToRows[fields[3][1]], Move.filesToCols[fields[3][0]])
+        halfmoveClock = int(fields[4]) if len(fields) > 4 else 0
+        fullmoveNumber = int(fields[5]) if len(fields) > 5 else 1
+        self._setPosition(board, fields[1] == "w", castleRights, enpassantPossible, halfmoveClock, fullmoveNumber)
+
+    def toFen(self):
+        rows = []
+        for row in self.board:
+            fenRow = ""
+            empty = 0
+            for piece in row:
+                if piece == "--":
+                    empty += 1
+                    continue
+                if empty:
+                    fenRow += str(empty)
+                    empty = 0
+                letter = "P" if piece[1] == "p" else piece[1]
+                fenRow += letter if piece[0] == "w" else letter.lower()
+            if empty:
+                fenRow += str(empty)
+            rows.append(fenRow)
+        rights = self.currentCastlingRight
+        castling = ("K" if rights.wks else "") + ("Q" if rights.wqs else "") + \
+                   ("k" if rights.bks else "") + ("q" if rights.bqs else "")
+        if self.enpassantPossible:
+            enpassant = Move.colsToFiles[self.enpassantPossible[1]] + Move.rowsToRanks[self.enpassantPossible[0]]
+        else:
+            enpassant = "-"
+        return "%s %s %s %s %d %d" % ("/".join(rows), "w" if self.whiteToMove else "b", castling or "-", enpassant,
+                                      self.halfmoveClock, self.fullmoveNumber)
+
+    """
+    Fixed width POSITION_BYTES (32 byte) packing of the position - see POSITION_STRUCT for the layout
+    """
+
+    def toBinary(self):
+        occupancy = 0
+        codes = []
+        for row in range(8):
+            for col in range(8):
+                piece = self.board[row][col]
+                if piece != "--":
+                    occupancy |= 1 << (row * 8 + col)
+                    codes.append(PIECE_CODE_INDEX[piece])
+        if len(codes) > 32:
+            raise ValueError("more than 32 pieces can't be packed")
+        codes.extend([0] * (32 - len(codes)))
+        pieces = bytes(codes[i] << 4 | codes[i + 1] for i in range(0, 32, 2))
+        rights = self.currentCastlingRight
+        flags = (0 if self.whiteToMove else 1) | rights.wks << 1 | rights.wqs << 2 | rights.bks << 3 | rights.bqs << 4
+        enpassantFile = self.enpassantPossible[1] + 1 if self.enpassantPossible else 0
+        return POSITION_STRUCT.pack(occupancy, pieces, flags, enpassantFile, min(self.halfmoveClock, 255),
+                                    min(self.fullmoveNumber, 0xFFFF))
+
+    def loadBinary(self, data):
+        if len(data) != POSITION_BYTES:
+            raise ValueError("packed positions are %d bytes, got %d" % (POSITION_BYTES, len(data)))
+        occupancy, pieces, flags, enpassantFile, halfmoveClock, fullmoveNumber = POSITION_STRUCT.unpack(data)
+        board = [["--"] * 8 for _ in range(8)]
+        codes = [nibble for byte in pieces for nibble in (byte >> 4, byte & 0xF)]
+        i = 0
+        while occupancy:  # only the occupied squares, lowest first
+            lsb = occupancy & -occupancy
+            sq = lsb.bit_length() - 1
+            board[sq >> 3][sq & 7] = PIECE_CODES[codes[i]]
+            i += 1
+            occupancy ^= lsb
+        whiteToMove = not flags & 1
+        castleRights = CastleRights(bool(flags & 2), bool(flags & 8), bool(flags & 4), bool(flags & 16))
+        if enpassantFile:
+            enpassantPossible = (2 if whiteToMove else 5, enpassantFile - 1)  # the square the pawn skipped
+        else:
+            enpassantPossible = ()
+        self._setPosition(board, whiteToMove, castleRights, enpassantPossible, halfmoveClock, fullmoveNumber)
+
+    def _setPosition(self, board, whiteToMove, castleRights, enpassantPossible, halfmoveClock, fullmoveNumber):
+        self.board = board
+        for row in range(8):
+            for col in range(8):
+                if board[row][col] == "wK":
+                    self.whiteKingLocation = (row, col)
+                elif board[row][col] == "bK":
+                    self.blackKingLocation = (row, col)
+        self.whiteToMove = whiteToMove
+        self.currentCastlingRight = castleRights
+        self.enpassantPossible = enpassantPossible
+        self.halfmoveClock = halfmoveClock
+        self.fullmoveNumber = fullmoveNumber
+        self.moveLog = []
+        self.checkMate = False
+        self.staleMate = False
+        self.enpassantPossibleLog = [self.enpassantPossible]
+        self.castleRightsLog = [self.currentCastlingRight.copy()]
+        self.halfmoveClockLog = [self.halfmoveClock]
+        self.zobristKey = self.computeZobristKey()
+        self.zobristLog = [self.zobristKey]
+
+    def updateCastleRights(self, move):
+        if move.pieceMoved == "wK":
+            self.currentCastlingRight.wks = False
+            self.currentCastlingRight.wqs = False
+        elif move.pieceMoved == "bK":
+            self.currentCastlingRight.bks = False
+            self.currentCastlingRight.bqs = False
+        elif move.pieceMoved == "wR" and move.startRow == 7:
+            if move.startCol == 0:
+                self.currentCastlingRight.wqs = False
+            elif move.startCol == 7:
+                self.currentCastlingRight.wks = False
+        elif move.pieceMoved == "bR" and move.startRow == 0:
+            if move.startCol == 0:
+                self.currentCastlingRight.bqs = False
+            elif move.startCol == 7:
+                self.currentCastlingRight.bks = False
+        # a rook captured on its home square takes that right with it
+        if move.pieceCaptured == "wR" and move.endRow == 7:
+            if move.endCol == 0:
+                self.currentCastlingRight.wqs = False
+            elif move.endCol == 7:
+                self.currentCastlingRight.wks = False
+        elif move.pieceCaptured == "bR" and move.endRow == 0:
+            if move.endCol == 0:
+                self.currentCastlingRight.bqs = False
+            elif move.endCol == 7:
+                self.currentCastlingRight.bks = False
+
+    """
+    Full Zobrist key recomputation from scratch - O(64), only meant as a debug check that
+    the key kept incrementally by makeMove/undoMove is still correct (gs.zobristKey == gs.computeZobristKey())
+    """
+
+    def computeZobristKey(self):
+        key = 0
+        for row in range(8):
+            for col in range(8):
+                piece = self.board[row][col]
+                if piece != "--":
+                    key ^= ZOBRIST_PIECES[piece][row * 8 + col]
+        if not self.whiteToMove:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        if self.enpassantPossible:
+            key ^= ZOBRIST_ENPASSANT[self.enpassantPossible[1]]
+        return key ^ self.currentCastlingRight.zobristKey()
 
     """
     All moves considering checks
+    checks and pins are found once by casting rays out from the king, so each pseudo legal move
+    can be kept or dropped without making it and regenerating the opponent's moves
     """
 
     def getValidMoves(self):
-        tempEnpassantPossible = self.enpassantPossible
-        # 1. Generate all possilbe moves
-        moves = self.getAllPossibleMoves()
-        # 2. for each move make the move
-        for i in range(len(moves) - 1, -1, -1):
-            self.makeMove(moves[i])
-            # 3. generate all opponents move
-            # 4. for each of the opponents move see if they attack your king
-            self.whiteToMove = not self.whiteToMove
-            if self.inCheck():
-                # 5. if they do attack your king it's not a valid move
-                moves.remove(moves[i])
-            self.whiteToMove = not self.whiteToMove
-            self.undoMove()
-
-            if len(moves) == 0:
-                if self.inCheck():
-                    self.checkMate = True
-                else:
-                    self.staleMate = True
+        if self.whiteToMove:
+            kingRow, kingCol = self.whiteKingLocation
+        else:
+            kingRow, kingCol = self.blackKingLocation
+        pins, checks = self.checkForPinsAndChecks()
+        if len(checks) > 1:  # double check - only the king can move
+            possibleMoves = []
+            self.getKingMoves(kingRow, kingCol, possibleMoves)
+        else:
+            possibleMoves = self.getAllPossibleMoves()
+        moves = self._legalMoves(possibleMoves, pins, checks)
+        if not checks:
+            self.getCastleMoves(kingRow, kingCol, moves)
+
+        if len(moves) == 0:
+            if checks:
+                self.checkMate = True
             else:
-                self.checkMate = False
-                self.staleMate = False
-        self.enpassantPossible = tempEnpassantPossible
+                self.staleMate = True
+        else:
+            self.checkMate = False
+            self.staleMate = False
         return moves
 
+    """
+    Legal captures, en passant captures and promotions only - the same moves getValidMoves would return
+    for those, without building any quiet moves. Leaves checkMate/staleMate alone
+    pinsAndChecks is checkForPinsAndChecks() when the caller already has it, e.g. to generate the quiet moves
+    of the same position with getValidQuiets afterwards
+    """
+
+    def getValidCaptures(self, pinsAndChecks=None):
+        pins, checks = pinsAndChecks if pinsAndChecks is not None else self.checkForPinsAndChecks()
+        if len(checks) > 1:
+            kingRow, kingCol = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+            possibleMoves = []
+            self.getKingMoves(kingRow, kingCol, possibleMoves)
+            possibleMoves = [move for move in possibleMoves if move.pieceCaptured != "--"]
+        else:
+            possibleMoves = self.getCaptureMoves()
+        return self._legalMoves(possibleMoves, pins, checks)
+
+    """
+    The rest of getValidMoves - legal moves that neither capture nor promote, castling included
+    """
+
+    def getValidQuiets(self, pinsAndChecks=None):
+        pins, checks = pinsAndChecks if pinsAndChecks is not None else self.checkForPinsAndChecks()
+        kingRow, kingCol = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        if len(checks) > 1:
+            possibleMoves = []
+            self.getKingMoves(kingRow, kingCol, possibleMoves)
+            possibleMoves = [move for move in possibleMoves if move.pieceCaptured == "--"]
+        else:
+            possibleMoves = self.getQuietMoves()
+        moves = self._legalMoves(possibleMoves, pins, checks)
+        if not checks:
+            self.getCastleMoves(kingRow, kingCol, moves)
+        return moves
+
+    """
+    Keep the pseudo legal moves that respect the pins and checks found by checkForPinsAndChecks
+    """
+
+    def _legalMoves(self, possibleMoves, pins, checks):
+        if self.whiteToMove:
+            kingRow, kingCol = self.whiteKingLocation
+        else:
+            kingRow, kingCol = self.blackKingLocation
+        enemyColor = "b" if self.whiteToMove else "w"
+        validSquares = None
+        if len(checks) == 1:  # capture the checking piece or block the line it checks along
+            checkRow, checkCol, direction = checks[0]
+            validSquares = {(checkRow, checkCol)}
+            if direction is not None:
+                r, c = kingRow + direction[0], kingCol + direction[1]
+                while (r, c) != (checkRow, checkCol):
+                    validSquares.add((r, c))
+                    r, c = r + direction[0], c + direction[1]
+
+        moves = []
+        for move in possibleMoves:
+            if move.pieceMoved[1] == "K":
+                if not self._kingMoveIsSafe(move, enemyColor):
+                    continue
+            elif move.isEnpassantMove:
+                # two pawns leave the board at once, so check the resulting position directly
+                if self._enpassantExposesKing(move, kingRow, kingCol, enemyColor):
+                    continue
+            else:
+                pinDirection = pins.get((move.startRow, move.startCol))
+                if pinDirection is not None and \
+                        (move.endRow - kingRow) * pinDirection[1] != (move.endCol - kingCol) * pinDirection[0]:
+                    continue  # pinned pieces can only move along the pin line
+                if validSquares is not None and (move.endRow, move.endCol) not in validSquares:
+                    continue
+            moves.append(move)
+        return moves
+
+    """
+    Cast rays out from the current player's king
+    returns pins as {(row, col): direction from the king} and checks as a list of (row, col, direction),
+    where direction is None for knight and pawn checks since those can't be blocked
+    """
+
+    def checkForPinsAndChecks(self):
+        pins = {}
+        checks = []
+        if self.whiteToMove:
+            allyColor, enemyColor = "w", "b"
+            kingRow, kingCol = self.whiteKingLocation
+        else:
+            allyColor, enemyColor = "b", "w"
+            kingRow, kingCol = self.blackKingLocation
+        for dr, dc in self.rayDirections:
+            sliders = ("R", "Q") if dr == 0 or dc == 0 else ("B", "Q")
+            possiblePin = None
+            r, c = kingRow + dr, kingCol + dc
+            while 0 <= r <= 7 and 0 <= c <= 7:
+                piece = self.board[r][c]
+                if piece != "--":
+                    if piece[0] == allyColor:
+                        if possiblePin is not None:
+                            break  # second allied piece on the ray - nothing is pinned
+                        possiblePin = (r, c)
+                    else:
+                        if piece[1] in sliders:
+                            if possiblePin is None:
+                                checks.append((r, c, (dr, dc)))
+                            else:
+                                pins[possiblePin] = (dr, dc)
+                        break
+                r, c = r + dr, c + dc
+        for dr, dc in self.knightOffsets:
+            r, c = kingRow + dr, kingCol + dc
+            if 0 <= r <= 7 and 0 <= c <= 7 and self.board[r][c] == enemyColor + "N":
+                checks.append((r, c, None))
+        pawnRow = kingRow - 1 if self.whiteToMove else kingRow + 1  # enemy pawns attack towards our side
+        if 0 <= pawnRow <= 7:
+            for c in (kingCol - 1, kingCol + 1):
+                if 0 <= c <= 7 and self.board[pawnRow][c] == enemyColor + "p":
+                    checks.append((pawnRow, c, None))
+        return pins, checks
+
+    def _kingMoveIsSafe(self, move, enemyColor):
+        # lift the king off the board so it can't block a ray aimed through its own square
+        self.board[move.startRow][move.startCol] = "--"
+        safe = not self.squareAttackedBy(move.endRow, move.endCol, enemyColor)
+        self.board[move.startRow][move.startCol] = move.pieceMoved
+        return safe
+
+    def _enpassantExposesKing(self, move, kingRow, kingCol, enemyColor):
+        self.board[move.startRow][move.startCol] = "--"
+        self.board[move.startRow][move.endCol] = "--"
+        self.board[move.endRow][move.endCol] = move.pieceMoved
+        exposed = self.squareAttackedBy(kingRow, kingCol, enemyColor)
+        self.board[move.startRow][move.startCol] = move.pieceMoved
+        self.board[move.startRow][move.endCol] = move.pieceCaptured
+        self.board[move.endRow][move.endCol] = "--"
+        return exposed
+
     """
     Determine if the current player is in check
     """
@@ -120,14 +545,137 @@ class GameState():
     Determine if the enemy can attack the square r, c
     """
     def squareUnderAttack(self, r, c):
-        self.whiteToMove = not self.whiteToMove  # switch turns to opponent
-        oppMoves = self.getAllPossibleMoves()  # get opponent moves
-        self.whiteToMove = not self.whiteToMove  # switch back
-        for move in oppMoves:
-            if move.endRow == r and move.endCol == c:  # square is under attack
+        return self.squareAttackedBy(r, c, "b" if self.whiteToMove else "w")
+
+    """
+    Determine if any piece of the given color attacks the square r, c
+    looks outward from the square along pawn, knight, king and sliding rays and stops at the first attacker
+    """
+    def squareAttackedBy(self, r, c, color):
+        pawnRow = r + 1 if color == "w" else r - 1  # white pawns attack upwards from the row below
+        if 0 <= pawnRow <= 7:
+            for col in (c - 1, c + 1):
+                if 0 <= col <= 7 and self.board[pawnRow][col] == color + "p":
+                    return True
+        for dr, dc in self.knightOffsets:
+            row, col = r + dr, c + dc
+            if 0 <= row <= 7 and 0 <= col <= 7 and self.board[row][col] == color + "N":
+                return True
+        for dr, dc in self.rayDirections:
+            row, col = r + dr, c + dc
+            if 0 <= row <= 7 and 0 <= col <= 7 and self.board[row][col] == color + "K":
                 return True
+        for dr, dc in self.rayDirections:
+            sliders = ("R", "Q") if dr == 0 or dc == 0 else ("B", "Q")
+            row, col = r + dr, c + dc
+            while 0 <= row <= 7 and 0 <= col <= 7:
+                piece = self.board[row][col]
+                if piece != "--":
+                    if piece[0] == color and piece[1] in sliders:
+                        return True
+                    break
+                row, col = row + dr, col + dc
         return False
-        pass
+
+    """
+    Every piece of the given color (the enemy by default) that attacks the square r, c as a list of (row, col)
+    used for static exchange evaluation and check evasion
+    """
+    def getAttackers(self, r, c, color=None):
+        if color is None:
+            color = "b" if self.whiteToMove else "w"
+        attackers = []
+        pawnRow = r + 1 if color == "w" else r - 1
+        if 0 <= pawnRow <= 7:
+            for col in (c - 1, c + 1):
+                if 0 <= col <= 7 and self.board[pawnRow][col] == color + "p":
+                    attackers.append((pawnRow, col))
+        for dr, dc in self.knightOffsets:
+            row, col = r + dr, c + dc
+            if 0 <= row <= 7 and 0 <= col <= 7 and self.board[row][col] == color + "N":
+                attackers.append((row, col))
+        for dr, dc in self.rayDirections:
+            sliders = ("R", "Q") if dr == 0 or dc == 0 else ("B", "Q")
+            row, col = r + dr, c + dc
+            while 0 <= row <= 7 and 0 <= col <= 7:
+                piece = self.board[row][col]
+                if piece != "--":
+                    if piece[0] == color and (piece[1] in sliders or
+                                              (piece[1] == "K" and (row, col) == (r + dr, c + dc))):
+                        attackers.append((row, col))
+                    break
+                row, col = row + dr, col + dc
+        return attackers
+
+    """
+    Static exchange evaluation - the material the side to move comes out with if both sides keep recapturing
+    on the target square of move with their least valuable attacker, each free to stop when recapturing would
+    lose; pieceValues maps piece types to values. Worked out from the attackers alone, without making moves:
+    pieces that have taken part are only marked as gone, which also uncovers sliders lined up behind them
+    """
+
+    def staticExchange(self, move, pieceValues):
+        r, c = move.endRow, move.endCol
+        removed = {(move.startRow, move.startCol)}
+        gains = [pieceValues[move.pieceCaptured[1]] if move.pieceCaptured != "--" else 0]
+        onSquare = pieceValues[move.pieceMoved[1]]
+        if move.isPawnPromotion:
+            gains[0] += pieceValues[move.promotionPiece] - pieceValues["p"]
+            onSquare = pieceValues[move.promotionPiece]
+        if move.isEnpassantMove:
+            removed.add((move.startRow, move.endCol))
+        color = "b" if move.pieceMoved[0] == "w" else "w"
+        while True:
+            attacker = self._leastValuableAttacker(r, c, color, removed)
+            if attacker is None:
+                break
+            row, col, pieceType = attacker
+            gain = onSquare
+            if pieceType == "p" and r in (0, 7):  # a pawn recapturing on the last rank promotes
+                gain += pieceValues["Q"] - pieceValues["p"]
+                pieceType = "Q"
+            gains.append(gain - gains[-1])  # what this side is up if it captures and the exchange stops there
+            if gains[-1] < -gains[-2]:
+                gains.pop()  # even unanswered the capture does worse than stopping here
+                break
+            onSquare = pieceValues[pieceType]
+            removed.add((row, col))
+            color = "b" if color == "w" else "w"
+        while len(gains) > 1:  # each side only continues the exchange while it pays
+            last = gains.pop()
+            gains[-1] = -max(-gains[-1], last)
+        return gains[0]
+
+    """
+    The cheapest piece of color attacking the square r, c as (row, col, piece type), ignoring the squares in
+    removed - None when there is no attacker left
+    """
+
+    def _leastValuableAttacker(self, r, c, color, removed):
+        pawnRow = r + 1 if color == "w" else r - 1
+        if 0 <= pawnRow <= 7:
+            for col in (c - 1, c + 1):
+                if 0 <= col <= 7 and self.board[pawnRow][col] == color + "p" and (pawnRow, col) not in removed:
+                    return pawnRow, col, "p"
+        for dr, dc in self.knightOffsets:
+            row, col = r + dr, c + dc
+            if 0 <= row <= 7 and 0 <= col <= 7 and self.board[row][col] == color + "N" and \
+                    (row, col) not in removed:
+                return row, col, "N"
+        best = None
+        for dr, dc in self.rayDirections:
+            sliders = ("R", "Q") if dr == 0 or dc == 0 else ("B", "Q")
+            row, col = r + dr, c + dc
+            while 0 <= row <= 7 and 0 <= col <= 7:
+                piece = self.board[row][col]
+                if piece != "--" and (row, col) not in removed:
+                    if piece[0] == color and (piece[1] in sliders or
+                                              (piece[1] == "K" and (row, col) == (r + dr, c + dc))):
+                        if best is None or self.attackerOrder[piece[1]] < self.attackerOrder[best[2]]:
+                            best = (row, col, piece[1])
+                    break
+                row, col = row + dr, col + dc
+        return best
 
     """
     All moves without considering checks
@@ -145,114 +693,167 @@ class GameState():
 
         return moves
 
+    """
+    Captures, en passant and promotions without considering checks - every enemy piece is looked at
+    from its own square with getAttackers, so no quiet moves are built
+    """
+
+    def getCaptureMoves(self):
+        moves = []
+        allyColor, enemyColor = ("w", "b") if self.whiteToMove else ("b", "w")
+        promotionRow = 1 if self.whiteToMove else 6
+        for row in range(8):
+            for col in range(8):
+                target = self.board[row][col]
+                if target[0] == enemyColor:
+                    for r, c in self.getAttackers(row, col, allyColor):
+                        piece = self.board[r][c]
+                        moves.append(Move((r, c), (row, col), piece, target))
+                        if piece[1] == "p" and r == promotionRow:
+                            for promotionPiece in ("R", "B", "N"):
+                                moves.append(Move((r, c), (row, col), piece, target, promotionPiece=promotionPiece))
+        if self.enpassantPossible:
+            epRow, epCol = self.enpassantPossible
+            pawnRow = epRow + 1 if self.whiteToMove else epRow - 1
+            for c in (epCol - 1, epCol + 1):
+                if 0 <= c <= 7 and self.board[pawnRow][c] == allyColor + "p":
+                    moves.append(Move((pawnRow, c), (epRow, epCol), allyColor + "p", "--", True))
+        pushRow = promotionRow - 1 if self.whiteToMove else promotionRow + 1
+        for col in range(8):
+            if self.board[promotionRow][col] == allyColor + "p" and self.board[pushRow][col] == "--":
+                for promotionPiece in ("Q", "R", "B", "N"):
+                    moves.append(Move((promotionRow, col), (pushRow, col), allyColor + "p",
+                                      promotionPiece=promotionPiece))
+        return moves
+
+    """
+    Moves that neither capture nor promote, without considering checks or castling - the piece generators
+    build captures and quiet moves together, so the captures are dropped afterwards
+    """
+
+    def getQuietMoves(self):
+        return [move for move in self.getAllPossibleMoves()
+                if move.pieceCaptured == "--" and not move.isPawnPromotion and not move.isEnpassantMove]
+
     """
     Get all pawn moves at the row and col and add these to the list
     """
 
     def getPawnMoves(self, row, col, moves):
+        piece = self.board[row][col]
+        first = len(moves)
         if self.whiteToMove:  # when a white pawn moves
             if self.board[row - 1][col] == "--":  # 1 square pawn advance
-                moves.append(Move((row, col), (row - 1, col), self.board))
+                moves.append(Move((row, col), (row - 1, col), piece))
                 if row == 6 and self.board[row - 2][col] == "--":  # 2 square pawn advance
-                    moves.append(Move((row, col), (row - 2, col), self.board))
+                    moves.append(Move((row, col), (row - 2, col), piece))
             if col - 1 >= 0:  # pawn captures diagonally left
                 if self.board[row - 1][col - 1][0] == "b":
-                    moves.append(Move((row, col), (row - 1, col - 1), self.board))
+                    moves.append(Move((row, col), (row - 1, col - 1), piece, self.board[row - 1][col - 1]))
                 elif (row - 1, col - 1) == self.enpassantPossible:
-                    moves.append(Move((row, col), (row - 1, col - 1), self.board, True))
+                    moves.append(Move((row, col), (row - 1, col - 1), piece, "--", True))
             if col + 1 <= 7:  # pawn captures diagonally right
                 if self.board[row - 1][col + 1][0] == "b":
-                    moves.append(Move((row, col), (row - 1, col + 1), self.board))
+                    moves.append(Move((row, col), (row - 1, col + 1), piece, self.board[row - 1][col + 1]))
                 elif (row - 1, col + 1) == self.enpassantPossible:
-                    moves.append(Move((row, col), (row - 1, col + 1), self.board, True))
+                    moves.append(Move((row, col), (row - 1, col + 1), piece, "--", True))
         else:
             if self.board[row + 1][col] == "--":
-                moves.append(Move((row, col), (row + 1, col), self.board))
+                moves.append(Move((row, col), (row + 1, col), piece))
                 if row == 1 and self.board[row + 2][col] == "--":
-                    moves.append(Move((row, col), (row + 2, col), self.board))
+                    moves.append(Move((row, col), (row + 2, col), piece))
             if col - 1 >= 0:
                 if self.board[row + 1][col - 1][0] == "w":  # pawn captures diagonally left
-                    moves.append(Move((row, col), (row + 1, col - 1), self.board))
+                    moves.append(Move((row, col), (row + 1, col - 1), piece, self.board[row + 1][col - 1]))
                 elif (row + 1, col - 1) == self.enpassantPossible:
-                    moves.append(Move((row, col), (row + 1, col - 1), self.board, True))
+                    moves.append(Move((row, col), (row + 1, col - 1), piece, "--", True))
             if col + 1 <= 7:
                 if self.board[row + 1][col + 1][0] == "w":
-                    moves.append(Move((row, col), (row + 1, col + 1), self.board))
+                    moves.append(Move((row, col), (row + 1, col + 1), piece, self.board[row + 1][col + 1]))
                 elif (row + 1, col + 1) == self.enpassantPossible:
-                    moves.append(Move((row, col), (row + 1, col + 1), self.board, True))
+                    moves.append(Move((row, col), (row + 1, col + 1), piece, "--", True))
+        if row == (1 if self.whiteToMove else 6):  # every move from here promotes - add the under promotions
+            for i in range(first, len(moves)):
+                move = moves[i]
+                for promotionPiece in ("R", "B", "N"):
+                    moves.append(Move((row, col), (move.endRow, move.endCol), piece, move.pieceCaptured,
+                                      promotionPiece=promotionPiece))
 
     def getRookMoves(self, row, col, moves):
+        piece = self.board[row][col]
         enemyColor = "b" if self.whiteToMove else "w"
         if row > 0:  # Check backwards
             for r in reversed((range(0, row))):
                 if self.board[r][col] == "--":
-                    moves.append(Move((row, col), (r, col), self.board))
+                    moves.append(Move((row, col), (r, col), piece))
                 elif self.board[r][col][0] == enemyColor:
-                    moves.append(Move((row, col), (r, col), self.board))
+                    moves.append(Move((row, col), (r, col), piece, self.board[r][col]))
                     break
                 else:
                     break
         if row < 7:  # Check forwards
             for r in range(row + 1, len(self.board)):
                 if self.board[r][col] == "--":
-                    moves.append(Move((row, col), (r, col), self.board))
+                    moves.append(Move((row, col), (r, col), piece))
                 elif self.board[r][col][0] == enemyColor:
-                    moves.append(Move((row, col), (r, col), self.board))
+                    moves.append(Move((row, col), (r, col), piece, self.board[r][col]))
                     break
                 else:
                     break
         if col > 0:  # Check left
             for c in reversed((range(0, col))):
                 if self.board[row][c] == "--":
-                    moves.append(Move((row, col), (row, c), self.board))
+                    moves.append(Move((row, col), (row, c), piece))
                 elif self.board[row][c][0] == enemyColor:
-                    moves.append(Move((row, col), (row, c), self.board))
+                    moves.append(Move((row, col), (row, c), piece, self.board[row][c]))
                     break
                 else:
                     break
         if col < 7:  # Check Right
             for c in range(col + 1, len(self.board)):
                 if self.board[row][c] == "--":
-                    moves.append(Move((row, col), (row, c), self.board))
+                    moves.append(Move((row, col), (row, c), piece))
                 elif self.board[row][c][0] == enemyColor:
-                    moves.append(Move((row, col), (row, c), self.board))
+                    moves.append(Move((row, col), (row, c), piece, self.board[row][c]))
                     break
                 else:
                     break
 
     def getKnightMoves(self, row, col, moves):
+        piece = self.board[row][col]
         enemyColor = "b" if self.whiteToMove else "w"
         if col > 0:
             if row < 6:  # backwards left long l
                 if self.board[row + 2][col - 1] == "--" or self.board[row + 2][col - 1][0] == enemyColor:
-                    moves.append(Move((row, col), (row + 2, col - 1), self.board))
+                    moves.append(Move((row, col), (row + 2, col - 1), piece, self.board[row + 2][col - 1]))
             if row > 1:  # forwards left long l
                 if self.board[row - 2][col - 1] == "--" or self.board[row - 2][col - 1][0] == enemyColor:
-                    moves.append(Move((row, col), (row - 2, col - 1), self.board))
+                    moves.append(Move((row, col), (row - 2, col - 1), piece, self.board[row - 2][col - 1]))
         if col < 7:
             if row < 6:  # backwards right long l
                 if self.board[row + 2][col + 1] == "--" or self.board[row + 2][col + 1][0] == enemyColor:
-                    moves.append(Move((row, col), (row + 2, col + 1), self.board))
+                    moves.append(Move((row, col), (row + 2, col + 1), piece, self.board[row + 2][col + 1]))
             if row > 1:  # forwards right long l
                 if self.board[row - 2][col + 1] == "--" or self.board[row - 2][col + 1][0] == enemyColor:
-                    moves.append(Move((row, col), (row - 2, col + 1), self.board))
+                    moves.append(Move((row, col), (row - 2, col + 1), piece, self.board[row - 2][col + 1]))
         if col > 1:
             if row > 0:  # forwards left horizontal l
                 if self.board[row - 1][col - 2] == "--" or self.board[row - 1][col - 2][0] == enemyColor:
-                    moves.append(Move((row, col), (row - 1, col - 2), self.board))
+                    moves.append(Move((row, col), (row - 1, col - 2), piece, self.board[row - 1][col - 2]))
             if row < 7:  # backwards left horizontal l
                 if self.board[row + 1][col - 2] == "--" or self.board[row + 1][col - 2][0] == enemyColor:
-                    moves.append(Move((row, col), (row + 1, col - 2), self.board))
+                    moves.append(Move((row, col), (row + 1, col - 2), piece, self.board[row + 1][col - 2]))
         if col < 6:
             if row > 0:
                 if self.board[row - 1][col + 2] == "--" or self.board[row - 1][col + 2][0] == enemyColor:
-                    moves.append(Move((row, col), (row - 1, col + 2), self.board))
+                    moves.append(Move((row, col), (row - 1, col + 2), piece, self.board[row - 1][col + 2]))
             if row < 7:
                 if self.board[row + 1][col + 2] == "--" or self.board[row + 1][col + 2][0] == enemyColor:
-                    moves.append(Move((row, col), (row + 1, col + 2), self.board))
+                    moves.append(Move((row, col), (row + 1, col + 2), piece, self.board[row + 1][col + 2]))
         pass
 
     def getBishopMoves(self, row, col, moves):
+        piece = self.board[row][col]
         enemyColor = "b" if self.whiteToMove else "w"
         if row > 0:
             if col > 0:
@@ -261,9 +862,9 @@ class GameState():
                         for c in reversed(range(0, col)):
                             if abs(row - r) == abs(col - c):
                                 if self.board[r][c] == "--":
-                                    moves.append(Move((row, col), (r, c), self.board))
+                                    moves.append(Move((row, col), (r, c), piece))
                                 elif self.board[r][c][0] == enemyColor:
-                                    moves.append(Move((row, col), (r, c), self.board))
+                                    moves.append(Move((row, col), (r, c), piece, self.board[r][c]))
                                     raise StopIteration
                                 else:
                                     raise StopIteration
@@ -275,9 +876,9 @@ class GameState():
                         for c in range(col + 1, len(self.board[0])):
                             if abs(row - r) == abs(col - c):
                                 if self.board[r][c] == "--":
-                                    moves.append(Move((row, col), (r, c), self.board))
+                                    moves.append(Move((row, col), (r, c), piece))
                                 elif self.board[r][c][0] == enemyColor:
-                                    moves.append(Move((row, col), (r, c), self.board))
+                                    moves.append(Move((row, col), (r, c), piece, self.board[r][c]))
                                     raise StopIteration
                                 else:
                                     raise StopIteration
@@ -291,9 +892,9 @@ class GameState():
                         for c in reversed(range(0, col)):
                             if abs(row - r) == abs(col - c):
                                 if self.board[r][c] == "--":
-                                    moves.append(Move((row, col), (r, c), self.board))
+                                    moves.append(Move((row, col), (r, c), piece))
                                 elif self.board[r][c][0] == enemyColor:
-                                    moves.append(Move((row, col), (r, c), self.board))
+                                    moves.append(Move((row, col), (r, c), piece, self.board[r][c]))
                                     raise StopIteration
                                 else:
                                     raise StopIteration
@@ -305,9 +906,9 @@ class GameState():
                         for c in range(col + 1, len(self.board[0])):
                             if abs(row - r) == abs(col - c):
                                 if self.board[r][c] == "--":
-                                    moves.append(Move((row, col), (r, c), self.board))
+                                    moves.append(Move((row, col), (r, c), piece))
                                 elif self.board[r][c][0] == enemyColor:
-                                    moves.append(Move((row, col), (r, c), self.board))
+                                    moves.append(Move((row, col), (r, c), piece, self.board[r][c]))
                                     raise StopIteration
                                 else:
                                     raise StopIteration
@@ -323,31 +924,79 @@ class GameState():
         pass
 
     def getKingMoves(self, row, col, moves):
+        piece = self.board[row][col]
         enemyColor = "b" if self.whiteToMove else "w"
         if col > 0:
             if self.board[row][col - 1] == "--" or self.board[row][col - 1][0] == enemyColor:
-                moves.append(Move((row, col), (row, col - 1), self.board))
+                moves.append(Move((row, col), (row, col - 1), piece, self.board[row][col - 1]))
             if row > 0:
                 if self.board[row - 1][col - 1] == "--" or self.board[row - 1][col - 1][0] == enemyColor:
-                    moves.append(Move((row, col), (row - 1, col - 1), self.board))
+                    moves.append(Move((row, col), (row - 1, col - 1), piece, self.board[row - 1][col - 1]))
             if row < 7:
                 if self.board[row + 1][col - 1] == "--" or self.board[row + 1][col - 1][0] == enemyColor:
-                    moves.append(Move((row, col), (row + 1, col - 1), self.board))
+                    moves.append(Move((row, col), (row + 1, col - 1), piece, self.board[row + 1][col - 1]))
         if row > 0:
             if self.board[row - 1][col] == "--" or self.board[row - 1][col][0] == enemyColor:
-                moves.append(Move((row, col), (row - 1, col), self.board))
+                moves.append(Move((row, col), (row - 1, col), piece, self.board[row - 1][col]))
         if row < 7:
             if self.board[row + 1][col] == "--" or self.board[row + 1][col][0] == enemyColor:
-                moves.append(Move((row, col), (row + 1, col), self.board))
+                moves.append(Move((row, col), (row + 1, col), piece, self.board[row + 1][col]))
         if col < 7:
             if self.board[row][col + 1] == "--" or self.board[row][col + 1][0] == enemyColor:
-                moves.append(Move((row, col), (row, col + 1), self.board))
+                moves.append(Move((row, col), (row, col + 1), piece, self.board[row][col + 1]))
             if row < 7:
                 if self.board[row + 1][col + 1] == "--" or self.board[row + 1][col + 1][0] == enemyColor:
-                    moves.append(Move((row, col), (row + 1, col + 1), self.board))
+                    moves.append(Move((row, col), (row + 1, col + 1), piece, self.board[row + 1][col + 1]))
             if row > 0:
                 if self.board[row - 1][col + 1] == "--" or self.board[row - 1][col + 1][0] == enemyColor:
-                    moves.append(Move((row, col), (row - 1, col + 1), self.board))
+                    moves.append(Move((row, col), (row - 1, col + 1), piece, self.board[row - 1][col + 1]))
+
+    """
+    Castling - the king may not be in check (getValidMoves only asks when it isn't), and the squares it
+    passes over and lands on must be empty and unattacked
+    """
+
+    def getCastleMoves(self, row, col, moves):
+        if self.whiteToMove:
+            allyColor, enemyColor, homeRow = "w", "b", 7
+            kingSide, queenSide = self.currentCastlingRight.wks, self.currentCastlingRight.wqs
+        else:
+            allyColor, enemyColor, homeRow = "b", "w", 0
+            kingSide, queenSide = self.currentCastlingRight.bks, self.currentCastlingRight.bqs
+        if (row, col) != (homeRow, 4):
+            return
+        piece = self.board[row][col]
+        if kingSide and self.board[row][5] == "--" and self.board[row][6] == "--" and \
+                self.board[row][7] == allyColor + "R":
+            if not self.squareAttackedBy(row, 5, enemyColor) and not self.squareAttackedBy(row, 6, enemyColor):
+                moves.append(Move((row, col), (row, 6), piece, isCastleMove=True))
+        if queenSide and self.board[row][3] == "--" and self.board[row][2] == "--" and \
+                self.board[row][1] == "--" and self.board[row][0] == allyColor + "R":
+            if not self.squareAttackedBy(row, 3, enemyColor) and not self.squareAttackedBy(row, 2, enemyColor):
+                moves.append(Move((row, col), (row, 2), piece, isCastleMove=True))
+
+
+class CastleRights():
+    def __init__(self, wks, bks, wqs, bqs):
+        self.wks = wks
+        self.bks = bks
+        self.wqs = wqs
+        self.bqs = bqs
+
+    def copy(self):
+        return CastleRights(self.wks, self.bks, self.wqs, self.bqs)
+
+    def zobristKey(self):
+        key = 0
+        if self.wks:
+            key ^= ZOBRIST_CASTLING[0]
+        if self.bks:
+            key ^= ZOBRIST_CASTLING[1]
+        if self.wqs:
+            key ^= ZOBRIST_CASTLING[2]
+        if self.bqs:
+            key ^= ZOBRIST_CASTLING[3]
+        return key
 
 
 class Move():
@@ -358,24 +1007,41 @@ class Move():
     filesToCols = {"a": 0, "b": 1, "c": 2, "d": 3, "e": 4, "f": 5, "g": 6, "h": 7}
     colsToFiles = {v: k for k, v in filesToCols.items()}
 
-    def __init__(self, startSq, endSq, board, isEnpassantMove = False):
-        self.startRow = startSq[0]
-        self.startCol = startSq[1]
-        self.endRow = endSq[0]
-        self.endCol = endSq[1]
-        self.pieceMoved = board[self.startRow][self.startCol]
-        self.pieceCaptured = board[self.endRow][self.endCol]
+    # promotion choice folded into moveID so under promotions compare unequal - a queen adds nothing
+    promotionIDs = {"Q": 0, "R": 1, "B": 2, "N": 3}
+
+    # no per move __dict__ - millions of these get built and thrown away during a search
+    __slots__ = ("startRow", "startCol", "endRow", "endCol", "pieceMoved", "pieceCaptured",
+                 "isPawnPromotion", "promotionPiece", "isEnpassantMove", "isCastleMove", "moveID")
+
+    """
+    The caller passes the piece strings it already has in hand, so building a move never reads the board
+    """
+
+    def __init__(self, startSq, endSq, pieceMoved, pieceCaptured="--", isEnpassantMove=False, isCastleMove=False,
+                 promotionPiece="Q"):
+        self.startRow, self.startCol = startSq
+        self.endRow, self.endCol = endSq
+        self.pieceMoved = pieceMoved
+        self.pieceCaptured = pieceCaptured
         self.moveID = self.startRow * 1000 + self.startCol * 100 + self.endRow * 10 + self.endCol
 
         #pawn promotion
-        self.isPawnPromotion = (self.pieceMoved == "wp" and self.endRow == 0) or (self.pieceMoved == "bp" and self.endRow == 7)
+        self.isPawnPromotion = pieceMoved[1] == "p" and (self.endRow == 0 or self.endRow == 7)
+        self.promotionPiece = promotionPiece
+        if self.isPawnPromotion:
+            self.moveID += self.promotionIDs[promotionPiece] * 10000
         # En passant
         self.isEnpassantMove = isEnpassantMove
 
-        if self.isEnpassantMove:
-            self.pieceCaptured = "wp" if self.pieceMoved == "bp" else "bp"
+        if isEnpassantMove:
+            self.pieceCaptured = "wp" if pieceMoved == "bp" else "bp"
+        # castle move
+        self.isCastleMove = isCastleMove
+
     """
-    Override equals method
+    Override equals and hash methods - moves are equal when they go from and to the same squares
+    and promote to the same piece
     """
 
     def __eq__(self, other):
@@ -383,8 +1049,14 @@ class Move():
             return self.moveID == other.moveID
         return False
 
+    def __hash__(self):
+        return self.moveID
+
     def getChessNotation(self):
-        return self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
+        notation = self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
+        if self.isPawnPromotion:
+            notation += self.promotionPiece.lower()
+        return notation
 
     def getRankFile(self, row, col):
         return self.colsToFiles[col] + self.rowsToRanks[row]
\ No newline at end of file
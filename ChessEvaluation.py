@@ -0,0 +1,182 @@
+"""
+static evaluation - material plus piece-square tables, in centipawns with positive scores good for white
+evaluate scores one GameState; evaluateBatch scores N positions packed into a NumPy array in a few
+vectorized operations (numpy is only needed for the batch functions)
+"""
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import ChessEngine
+
+pieceScore = {"K": 0, "Q": 900, "R": 500, "B": 330, "N": 320, "p": 100}
+
+# piece-square tables from white's point of view, laid out like the board: row 0 is rank 8
+piecePositionScores = {
+    "p": [
+        [0, 0, 0, 0, 0, 0, 0, 0],
+        [50, 50, 50, 50, 50, 50, 50, 50],
+        [10, 10, 20, 30, 30, 20, 10, 10],
+        [5, 5, 10, 25, 25, 10, 5, 5],
+        [0, 0, 0, 20, 20, 0, 0, 0],
+        [5, -5, -10, 0, 0, -10, -5, 5],
+        [5, 10, 10, -20, -20, 10, 10, 5],
+        [0, 0, 0, 0, 0, 0, 0, 0],
+    ],
+    "N": [
+        [-50, -40, -30, -30, -30, -30, -40, -50],
+        [-40, -20, 0, 0, 0, 0, -20, -40],
+        [-30, 0, 10, 15, 15, 10, 0, -30],
+        [-30, 5, 15, 20, 20, 15, 5, -30],
+        [-30, 0, 15, 20, 20, 15, 0, -30],
+        [-30, 5, 10, 15, 15, 10, 5, -30],
+        [-40, -20, 0, 5, 5, 0, -20, -40],
+        [-50, -40, -30, -30, -30, -30, -40, -50],
+    ],
+    "B": [
+        [-20, -10, -10, -10, -10, -10, -10, -20],
+        [-10, 0, 0, 0, 0, 0, 0, -10],
+        [-10, 0, 5, 10, 10, 5, 0, -10],
+        [-10, 5, 5, 10, 10, 5, 5, -10],
+        [-10, 0, 10, 10, 10, 10, 0, -10],
+        [-10, 10, 10, 10, 10, 10, 10, -10],
+        [-10, 5, 0, 0, 0, 0, 5, -10],
+        [-20, -10, -10, -10, -10, -10, -10, -20],
+    ],
+    "R": [
+        [0, 0, 0, 0, 0, 0, 0, 0],
+        [5, 10, 10, 10, 10, 10, 10, 5],
+        [-5, 0, 0, 0, 0, 0, 0, -5],
+        [-5, 0, 0, 0, 0, 0, 0, -5],
+        [-5, 0, 0, 0, 0, 0, 0, -5],
+        [-5, 0, 0, 0, 0, 0, 0, -5],
+        [-5, 0, 0, 0, 0, 0, 0, -5],
+        [0, 0, 0, 5, 5, 0, 0, 0],
+    ],
+    "Q": [
+        [-20, -10, -10, -5, -5, -10, -10, -20],
+        [-10, 0, 0, 0, 0, 0, 0, -10],
+        [-10, 0, 5, 5, 5, 5, 0, -10],
+        [-5, 0, 5, 5, 5, 5, 0, -5],
+        [0, 0, 5, 5, 5, 5, 0, -5],
+        [-10, 5, 5, 5, 5, 5, 0, -10],
+        [-10, 0, 5, 0, 0, 0, 0, -10],
+        [-20, -10, -10, -5, -5, -10, -10, -20],
+    ],
+    "K": [
+        [-30, -40, -40, -50, -50, -40, -40, -30],
+        [-30, -40, -40, -50, -50, -40, -40, -30],
+        [-30, -40, -40, -50, -50, -40, -40, -30],
+        [-30, -40, -40, -50, -50, -40, -40, -30],
+        [-20, -30, -30, -40, -40, -30, -30, -20],
+        [-10, -20, -20, -20, -20, -20, -20, -10],
+        [20, 20, 0, 0, 0, 0, 20, 20],
+        [20, 30, 10, 0, 0, 10, 30, 20],
+    ],
+}
+
+# the array layouts follow ChessEngine.PIECE_CODES: (N, 12, 64) planes are in that order, and in the (N, 64)
+# layout a square holds 0 when empty, 1..6 for the white pieces in that order and -1..-6 for the black ones
+SIGNED_CODES = {piece: (i + 1 if i < 6 else 5 - i) for i, piece in enumerate(ChessEngine.PIECE_CODES)}
+
+
+def _squareScores(piece):
+    # signed score of piece on each of the 64 squares (row * 8 + col) - black reads the tables mirrored
+    pieceType = piece[1]
+    scores = []
+    for row in range(8):
+        for col in range(8):
+            if piece[0] == "w":
+                scores.append(pieceScore[pieceType] + piecePositionScores[pieceType][row][col])
+            else:
+                scores.append(-pieceScore[pieceType] - piecePositionScores[pieceType][7 - row][col])
+    return scores
+
+
+SQUARE_SCORES = {piece: _squareScores(piece) for piece in ChessEngine.PIECE_CODES}
+
+
+"""
+Score of a board - positive is good for white
+"""
+
+
+def scoreBoard(board):
+    score = 0
+    for row in range(8):
+        boardRow = board[row]
+        for col in range(8):
+            piece = boardRow[col]
+            if piece != "--":
+                score += SQUARE_SCORES[piece][row * 8 + col]
+    return score
+
+
+def evaluate(gs):
+    return scoreBoard(gs.board)
+
+
+"""
+Batch API
+"""
+
+
+def _requireNumpy():
+    if np is None:
+        raise ImportError("the batch evaluation API needs numpy")
+
+
+_weights = None
+
+
+def _batchWeights():
+    # (12, 64) signed square scores and the matching (13, 64) lookup indexed by piece code + 6
+    global _weights
+    if _weights is None:
+        planes = np.array([SQUARE_SCORES[piece] for piece in ChessEngine.PIECE_CODES], dtype=np.int32)
+        lookup = np.zeros((13, 64), dtype=np.int32)
+        for i, piece in enumerate(ChessEngine.PIECE_CODES):
+            lookup[SIGNED_CODES[piece] + 6] = planes[i]
+        _weights = (planes, lookup)
+    return _weights
+
+
+"""
+Pack the boards of gameStates (GameState objects or bare board grids) into an int8 array -
+(N, 64) piece codes by default or (N, 12, 64) one-hot piece planes with planes=True
+"""
+
+
+def boardsToArray(gameStates, planes=False):
+    _requireNumpy()
+    boards = [gs if isinstance(gs, list) else gs.board for gs in gameStates]
+    codes = np.zeros((len(boards), 64), dtype=np.int8)
+    for n, board in enumerate(boards):
+        row = codes[n]
+        for sq in range(64):
+            piece = board[sq // 8][sq % 8]
+            if piece != "--":
+                row[sq] = SIGNED_CODES[piece]
+    if not planes:
+        return codes
+    # plane i is set where the code belongs to ChessEngine.PIECE_CODES[i]
+    planeCodes = np.array([SIGNED_CODES[piece] for piece in ChessEngine.PIECE_CODES], dtype=np.int8)
+    return (codes[:, None, :] == planeCodes[None, :, None]).astype(np.int8)
+
+
+"""
+Score N positions at once - takes an (N, 64) piece code array or an (N, 12, 64) piece plane array as built by
+boardsToArray and returns an int32 array of N scores, positive good for white
+"""
+
+
+def evaluateBatch(positions):
+    _requireNumpy()
+    positions = np.asarray(positions)
+    planeWeights, lookup = _batchWeights()
+    if positions.ndim == 3 and positions.shape[1:] == (12, 64):
+        return np.einsum("npq,pq->n", positions.astype(np.int32), planeWeights)
+    if positions.ndim == 2 and positions.shape[1] == 64:
+        return lookup[positions.astype(np.intp) + 6, np.arange(64)].sum(axis=1, dtype=np.int32)
+    raise ValueError("expected an (N, 64) or (N, 12, 64) array, got shape %s" % (positions.shape,))
@@ -6,13 +6,19 @@ import sys
 import pygame as p
 import pygame.image
 
+import ChessBook
 import ChessEngine
+import ChessWorker
 
 WIDTH = HEIGHT = 512
 DIMENSION = 8   #Chessboard 8x8
 SQ_SIZE = HEIGHT // DIMENSION   #Size of squares
 MAX_FPS = 15    #For animations
 IMAGES = {}
+PLAYER_ONE = True   #True if a human plays white, False if the engine does
+PLAYER_TWO = False  #same for black
+ENGINE_TIME_MS = 2000   #engine think time per move
+BOOK_PATH = None    #opening book built with ChessBook.py - the engine plays from it before searching
 
 """
 Load Images - init global dictionary of images. Called once in the main file
@@ -34,10 +40,17 @@ def main():
     screen = p.display.set_mode((WIDTH, HEIGHT))
     clock = p.time.Clock()
     screen.fill(p.Color("white"))
+    boardSurface = p.Surface((WIDTH, HEIGHT))   #empty board drawn once and copied from after that
+    drawBoard(boardSurface)
 
     gs = ChessEngine.GameState()
     validMoves = gs.getValidMoves()
     moveMade = False    #flag var when a move is made
+    book = ChessBook.OpeningBook(BOOK_PATH) if BOOK_PATH else None
+    engine = ChessWorker.BackgroundEngine(book=book)    #searches on its own thread so the window never freezes
+    engineThinking = False
+    fullRedraw = True   #draw everything on the first frame
+    dirtySquares = set()    #squares to redraw this frame
 
     loadImages()     #only do this once
 
@@ -45,12 +58,17 @@ def main():
     sqSelected = ()     #no sq is selected initially
     playerClicks = []   #keeps track of player clicks (2 tuples : [(6, 4), (4, 4)])
     while running:
+        humanTurn = (gs.whiteToMove and PLAYER_ONE) or (not gs.whiteToMove and PLAYER_TWO)
         for event in pygame.event.get():
             if event.type == p.QUIT:
                 running = False
+                engine.close()
                 sys.exit()
 
-            elif event.type == p.MOUSEBUTTONDOWN:
+            elif event.type == p.VIDEOEXPOSE:   #window uncovered - the screen contents are gone
+                fullRedraw = True
+
+            elif event.type == p.MOUSEBUTTONDOWN and humanTurn:
                 location = p.mouse.get_pos() #(x,y) location of the mouse
                 col = location[0] // SQ_SIZE
                 row = location[1] // SQ_SIZE
@@ -63,38 +81,99 @@ def main():
                     playerClicks.append(sqSelected)     #append for both 1st and 2nd clicks
 
                 if len(playerClicks) == 2:  #check to see if it is the 2nd click
-                    move = ChessEngine.Move(playerClicks[0], playerClicks[1], gs.board)
+                    startRow, startCol = playerClicks[0]
+                    move = ChessEngine.Move(playerClicks[0], playerClicks[1], gs.board[startRow][startCol])
                     print(move.getChessNotation())
                     for i in range(len(validMoves)):
                         if move == validMoves[i]:
                             gs.makeMove(validMoves[i])
+                            dirtySquares.update(moveSquares(validMoves[i]))
                             moveMade = True
                             sqSelected = ()
                             playerClicks = []
+                            #later clicks in this batch of events belong to whoever moves now
+                            humanTurn = (gs.whiteToMove and PLAYER_ONE) or (not gs.whiteToMove and PLAYER_TWO)
+                            break
                     if not moveMade:
                         playerClicks = [sqSelected]
 
             elif event.type == p.KEYDOWN:
                 if event.key == p.K_ESCAPE:
                     running = False
+                    engine.close()
                     sys.exit()
                 if event.key == p.K_z:
-                    gs.undoMove()
-                    moveMade = True
+                    engine.cancel()     #whatever the engine was thinking about is gone now
+                    engineThinking = False
+                    while gs.moveLog:
+                        dirtySquares.update(moveSquares(gs.moveLog[-1]))
+                        gs.undoMove()
+                        moveMade = True
+                        humanTurn = (gs.whiteToMove and PLAYER_ONE) or (not gs.whiteToMove and PLAYER_TWO)
+                        if humanTurn or not (PLAYER_ONE or PLAYER_TWO):
+                            break   #back to a human's move - an engine move alone would just be played again
+
+        #engine - start thinking on its turn, and poll for its answer without blocking the frame
+        if not humanTurn and not engineThinking and validMoves:
+            engine.think(gs, ENGINE_TIME_MS)
+            engineThinking = True
+        update = engine.poll()
+        if update is not None:
+            if update.result.bestMove is not None:
+                p.display.set_caption("depth %d: %s (%d)" % (update.result.depth,
+                                      update.result.bestMove.getChessNotation(), update.result.score))
+            if update.done and not update.ponder and engineThinking:
+                engineThinking = False
+                for move in validMoves:
+                    if move == update.bestMove:     #play our own copy of the move found on the worker
+                        gs.makeMove(move)
+                        dirtySquares.update(moveSquares(move))
+                        moveMade = True
+                        engine.ponder(gs)   #keep searching on the opponent's time
+                        break
 
         if moveMade:
             validMoves = gs.getValidMoves()
             moveMade = False
-        drawGameState(screen, gs)
+        if fullRedraw or dirtySquares:     #nothing changed - leave the screen alone
+            dirtyRects = drawGameState(screen, boardSurface, gs, None if fullRedraw else dirtySquares)
+            p.display.update(dirtyRects)
+            fullRedraw = False
+            dirtySquares.clear()
         clock.tick(MAX_FPS)
-        p.display.update()
 
 """
-responsible for all graphics on game screen
+responsible for all graphics on game screen - redraws the given squares from the cached board surface
+(everything when squares is None) and returns the rects that changed for display.update
+"""
+def drawGameState(screen, boardSurface, gs, squares=None):
+    if squares is None:
+        screen.blit(boardSurface, (0, 0))
+        drawPieces(screen, gs.board)
+        return [screen.get_rect()]
+    rects = []
+    for row, col in squares:
+        rect = p.Rect(col * SQ_SIZE, row * SQ_SIZE, SQ_SIZE, SQ_SIZE)
+        screen.blit(boardSurface, rect, rect)   #the empty square under whatever was there
+        piece = gs.board[row][col]
+        if piece != "--":
+            screen.blit(IMAGES[piece], rect)
+        rects.append(rect)
+    return rects
+
+"""
+squares a move changes - from and to, plus the rook's squares when castling and the taken pawn's for en passant
 """
-def drawGameState(screen, gs):
-    drawBoard(screen)
-    drawPieces(screen, gs.board)
+def moveSquares(move):
+    squares = [(move.startRow, move.startCol), (move.endRow, move.endCol)]
+    if move.isCastleMove:
+        if move.endCol - move.startCol == 2:    #king side
+            squares += [(move.endRow, move.endCol + 1), (move.endRow, move.endCol - 1)]
+        else:   #queen side
+            squares += [(move.endRow, move.endCol - 2), (move.endRow, move.endCol + 1)]
+    elif move.isEnpassantMove:
+        squares.append((move.startRow, move.endCol))
+    return squares
 
 """
 draws squares on the board
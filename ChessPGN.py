@@ -0,0 +1,193 @@
+"""
+streaming PGN reader - games are read one at a time from a memory-mapped file, their SAN moves resolved
+against GameState.getValidMoves and replayed with makeMove
+only the game being read is ever held in memory, so archives of any size can be replayed
+
+    for summary in ChessPGN.replayFile("games.pgn"):
+        print(summary.tags.get("White"), summary.result, summary.plies)
+"""
+import mmap
+import re
+
+import ChessEngine
+
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+# comments, rest of line comments, NAGs and move numbers - everything in movetext that isn't a move
+_NOISE = re.compile(r"\{[^}]*\}|;[^\n]*|\$\d+|\d+\.(\.\.)?")
+_TAG = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+_SAN = re.compile(r"^([NBRQK])?([a-h])?([1-8])?(x)?([a-h][1-8])(?:=?([NBRQ]))?$")
+
+
+class PgnGame():
+    def __init__(self, tags, movetext):
+        self.tags = tags  # {"White": ..., "Result": ...}
+        self.movetext = movetext
+
+
+class GameSummary():
+    def __init__(self, tags, result, plies, finalFen, error=None):
+        self.tags = tags
+        self.result = result
+        self.plies = plies  # moves replayed, which stops short of the full game if error is set or at maxPly
+        self.finalFen = finalFen
+        self.error = error  # why replay stopped early, None if every move was legal
+
+
+"""
+Lines of a file read through mmap - the OS pages the file in and out, nothing is read up front
+"""
+
+
+def mappedLines(path):
+    with open(path, "rb") as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty files can't be mapped
+            return
+        try:
+            for line in iter(mm.readline, b""):
+                yield line.decode("utf-8", errors="replace")
+        finally:
+            mm.close()
+
+
+"""
+Split a stream of PGN lines into PgnGame objects, one game at a time
+"""
+
+
+def iterGames(lines):
+    tags = {}
+    movetext = []
+    for line in lines:
+        line = line.strip()
+        if line.startswith("%"):  # escape line
+            continue
+        if line.startswith("["):
+            if movetext:  # a tag after movetext starts the next game
+                yield PgnGame(tags, " ".join(movetext))
+                tags, movetext = {}, []
+            match = _TAG.match(line)
+            if match:
+                tags[match.group(1)] = match.group(2).replace('\\"', '"').replace("\\\\", "\\")
+        elif line:
+            movetext.append(line)
+            if line.split()[-1] in RESULTS and not _openComment(movetext):
+                yield PgnGame(tags, " ".join(movetext))
+                tags, movetext = {}, []
+    if movetext or tags:
+        yield PgnGame(tags, " ".join(movetext))
+
+
+def _openComment(movetext):
+    text = " ".join(movetext)
+    return text.count("{") > text.count("}")
+
+
+"""
+The SAN tokens of a game's movetext, with comments, variations, NAGs, move numbers and the result removed
+"""
+
+
+def sanTokens(movetext):
+    text = _NOISE.sub(" ", movetext)
+    tokens = []
+    depth = 0  # variation nesting
+    for token in text.replace("(", " ( ").replace(")", " ) ").split():
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth = max(depth - 1, 0)
+        elif depth == 0 and token not in RESULTS:
+            tokens.append(token)
+    return tokens
+
+
+"""
+Resolve a SAN move such as Nbd7, exd6, e8=Q+ or O-O against the legal moves of gs - a capture marker has to
+match whether the move really captures, so damaged movetext is caught instead of replayed as something else
+"""
+
+
+def sanToMove(gs, san, validMoves=None):
+    if validMoves is None:
+        validMoves = gs.getValidMoves()
+    text = san.rstrip("+#!?")
+    if text in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        endCol = 6 if len(text) == 3 else 2
+        for move in validMoves:
+            if move.isCastleMove and move.endCol == endCol:
+                return move
+        raise ValueError("illegal move " + san)
+    match = _SAN.match(text)
+    if match is None:
+        raise ValueError("unreadable move " + san)
+    pieceType, fromFile, fromRank, capture, target, promotion = match.groups()
+    pieceType = pieceType or "p"
+    endRow = ChessEngine.Move.ranksToRows[target[1]]
+    endCol = ChessEngine.Move.filesToCols[target[0]]
+    candidates = []
+    for move in validMoves:
+        if move.endRow != endRow or move.endCol != endCol or move.pieceMoved[1] != pieceType:
+            continue
+        if fromFile is not None and move.startCol != ChessEngine.Move.filesToCols[fromFile]:
+            continue
+        if fromRank is not None and move.startRow != ChessEngine.Move.ranksToRows[fromRank]:
+            continue
+        if move.isPawnPromotion and move.promotionPiece != (promotion or "Q"):
+            continue
+        candidates.append(move)
+    if len(candidates) != 1:
+        raise ValueError(("ambiguous move " if candidates else "illegal move ") + san)
+    move = candidates[0]
+    if (capture is not None) != (move.pieceCaptured != "--" or move.isEnpassantMove):
+        raise ValueError(("nothing to capture in " if capture else "capture not marked in ") + san)
+    return move
+
+
+"""
+Replay one game - yields the GameState after every move when yieldPositions is set, and returns a GameSummary
+the yielded state is live and changes with the next move, so copy what you need (e.g. gs.toBinary())
+with maxPly only that many moves are replayed and the rest of the game is never resolved
+"""
+
+
+def replayGame(game, yieldPositions=False, gameStateClass=ChessEngine.GameState, maxPly=None):
+    if "FEN" in game.tags:
+        gs = gameStateClass.fromFen(game.tags["FEN"])
+    else:
+        gs = gameStateClass()
+    error = None
+    tokens = sanTokens(game.movetext)
+    if maxPly is not None:
+        tokens = tokens[:maxPly]
+    for san in tokens:
+        try:
+            move = sanToMove(gs, san)
+        except ValueError as e:
+            error = "ply %d: %s" % (len(gs.moveLog) + 1, e)
+            break
+        gs.makeMove(move)
+        if yieldPositions:
+            yield gs
+    return GameSummary(game.tags, game.tags.get("Result", "*"), len(gs.moveLog), gs.toFen(), error)
+
+
+"""
+Stream every game of a PGN file - yields a GameSummary per game; when yieldPositions is set it yields
+(PgnGame, GameState) after every move instead, then (PgnGame, GameSummary) once the game ends, so games cut
+short can still be told apart; games with an illegal move stop there and report it in error, and with maxPly
+every game stops after that many moves
+"""
+
+
+def replayFile(path, yieldPositions=False, gameStateClass=ChessEngine.GameState, maxPly=None):
+    for game in iterGames(mappedLines(path)):
+        replay = replayGame(game, yieldPositions, gameStateClass, maxPly)
+        while True:
+            try:
+                gs = next(replay)
+            except StopIteration as stop:
+                yield (game, stop.value) if yieldPositions else stop.value
+                break
+            yield game, gs
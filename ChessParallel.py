@@ -0,0 +1,109 @@
+"""
+runs perft and search across CPU cores - the root moves from getValidMoves are split over a ProcessPoolExecutor
+workers are sent the packed binary position instead of a pickled GameState (whose moveFunctions dict holds
+bound methods) and rebuild the position themselves
+"""
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import ChessAI
+import ChessPerft
+
+
+"""
+Positions travel to the workers in the 32 byte binary form from GameState.toBinary
+"""
+
+
+def serializePosition(gs):
+    return gs.toBinary()
+
+
+def deserializePosition(data, backend="grid"):
+    return ChessPerft.BACKENDS[backend].fromBinary(data)
+
+
+def _findMove(gs, notation):
+    for move in gs.getValidMoves():
+        if move.getChessNotation() == notation:
+            return move
+    raise ValueError("illegal move " + notation)
+
+
+def _perftWorker(data, backend, notation, depth):
+    gs = deserializePosition(data, backend)
+    gs.makeMove(_findMove(gs, notation))
+    return notation, ChessPerft.perft(gs, depth - 1)
+
+
+"""
+Search one worker's share of the root moves - returns the result of every completed depth, shallowest first,
+and the total node count
+"""
+
+
+def _searchWorker(data, backend, notations, depth, deadline, nodeLimit, ttSizeMB):
+    gs = deserializePosition(data, backend)
+    searchMoves = [_findMove(gs, notation) for notation in notations]
+    # the clock started in the parent - only what is left of it once this process got going is searched
+    timeLimitMs = max(0, (deadline - time.time()) * 1000) if deadline is not None else None
+    iterations = []
+    searcher = ChessAI.Searcher(ChessAI.TranspositionTable(ttSizeMB))
+    result = searcher.search(gs, depth, timeLimitMs, nodeLimit, searchMoves, onIteration=iterations.append)
+    return iterations or [result], result.nodes
+
+
+"""
+Perft split by root move over a pool of worker processes - returns (total nodes, [(move notation, nodes)])
+"""
+
+
+def parallelPerft(gs, depth, workers=None, backend="grid"):
+    moves = gs.getValidMoves()
+    if depth <= 1:
+        return len(moves), [(move.getChessNotation(), 1) for move in moves]
+    data = serializePosition(gs)
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = [executor.submit(_perftWorker, data, backend, move.getChessNotation(), depth) for move in moves]
+        results = [future.result() for future in futures]
+    return sum(count for _, count in results), results
+
+
+"""
+Root split search - the root moves are dealt round robin to the workers and every worker runs its own
+iterative deepening over its share; scores from different depths aren't comparable, so the best result is
+picked at the deepest depth every worker completed (workers that completed none are left out)
+the limits hold for the search as a whole - the workers share one deadline set before the pool starts, split
+nodeLimit between them and each get an equal part of the ttSizeMB transposition table memory; nodes are
+summed over all workers
+"""
+
+
+def parallelSearch(gs, depth=None, timeLimitMs=None, nodeLimit=None, workers=None, backend="grid",
+                   ttSizeMB=ChessAI.DEFAULT_TT_MB):
+    deadline = time.time() + timeLimitMs / 1000 if timeLimitMs is not None else None
+    moves = gs.getValidMoves()
+    workers = min(workers or os.cpu_count(), max(len(moves), 1))
+    if len(moves) <= 1 or workers == 1:
+        return ChessAI.Searcher(ChessAI.TranspositionTable(ttSizeMB)).search(gs, depth, timeLimitMs, nodeLimit)
+    data = serializePosition(gs)
+    shares = [[move.getChessNotation() for move in moves[i::workers]] for i in range(workers)]
+    workerTTMB = max(1, ttSizeMB // workers)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        for i, share in enumerate(shares):
+            # the remainder goes to the first workers so the budgets add up to nodeLimit exactly
+            workerNodes = nodeLimit // workers + (i < nodeLimit % workers) if nodeLimit is not None else None
+            futures.append(executor.submit(_searchWorker, data, backend, share, depth, deadline, workerNodes,
+                                           workerTTMB))
+        results = [future.result() for future in futures]
+    completed = [iterations for iterations, _ in results if iterations[-1].depth > 0] or [results[0][0]]
+    commonDepth = min(iterations[-1].depth for iterations in completed)
+    best = max((next(result for result in iterations if result.depth >= commonDepth) for iterations in completed),
+               key=lambda result: result.score)
+    # hand back the caller's own Move objects rather than the copies unpickled from the workers
+    best.bestMove = moves[moves.index(best.bestMove)]
+    best.pv[0] = best.bestMove
+    best.nodes = sum(nodes for _, nodes in results)
+    return best
@@ -0,0 +1,153 @@
+"""
+perft - counts the leaf nodes of the legal move tree to a fixed depth
+benchmarks move generation (nodes/sec) and checks it against published node counts
+
+    python ChessPerft.py --depth 4                        count from the start position
+    python ChessPerft.py --position kiwipete --depth 3 --divide
+    python ChessPerft.py --fen "<fen>" --depth 3
+    python ChessPerft.py --regression --max-nodes 500000  compare every position against the published counts
+    python ChessPerft.py --depth 5 --workers 8            split the root moves over 8 processes
+    python ChessPerft.py --depth 4 --stats                print hot path call counts and times as JSON
+"""
+import argparse
+import sys
+import time
+
+import ChessBitboard
+import ChessEngine
+
+STARTING_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+# standard test positions and their published node counts for depth 1, 2, 3...
+POSITIONS = {
+    "startpos": (STARTING_FEN, [20, 400, 8902, 197281, 4865609, 119060324]),
+    "kiwipete": ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+                 [48, 2039, 97862, 4085603, 193690690]),
+    "position3": ("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", [14, 191, 2812, 43238, 674624, 11030083]),
+    "position4": ("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+                  [6, 264, 9467, 422333, 15833292]),
+    "position5": ("rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8", [44, 1486, 62379, 2103487, 89941194]),
+    "position6": ("r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+                  [46, 2079, 89890, 3894594, 164075551]),
+}
+
+BACKENDS = {"grid": ChessEngine.GameState, "bitboard": ChessBitboard.BitboardGameState}
+
+
+"""
+Number of leaf nodes depth plies below gs
+"""
+
+
+def perft(gs, depth):
+    if depth == 0:
+        return 1
+    moves = gs.getValidMoves()
+    if depth == 1:
+        return len(moves)  # bulk counting - the leaves don't need to be made
+    nodes = 0
+    for move in moves:
+        gs.makeMove(move)
+        nodes += perft(gs, depth - 1)
+        gs.undoMove()
+    return nodes
+
+
+"""
+Perft split by root move - returns a list of (move notation, node count)
+"""
+
+
+def divide(gs, depth):
+    results = []
+    for move in gs.getValidMoves():
+        gs.makeMove(move)
+        results.append((move.getChessNotation(), perft(gs, depth - 1)))
+        gs.undoMove()
+    return results
+
+
+def loadPosition(fen, backend="grid"):
+    return BACKENDS[backend].fromFen(fen)
+
+
+def runPerft(fen, depth, backend="grid", showDivide=False, workers=1, out=sys.stdout):
+    gs = loadPosition(fen, backend)
+    start = time.perf_counter()
+    if workers != 1:
+        import ChessParallel  # imports this module, so only pulled in when asked for
+        nodes, results = ChessParallel.parallelPerft(gs, depth, workers, backend)
+    elif showDivide:
+        results = divide(gs, depth)
+        nodes = sum(count for _, count in results)
+    else:
+        results = None
+        nodes = perft(gs, depth)
+    if showDivide:
+        for notation, count in results:
+            print("%s: %d" % (notation, count), file=out)
+    elapsed = time.perf_counter() - start
+    print("depth %d: %d nodes in %.2fs (%d nodes/sec)" % (depth, nodes, elapsed, nodes / max(elapsed, 1e-9)),
+          file=out)
+    return nodes
+
+
+"""
+Compare every test position against its published counts up to the deepest depth whose count is
+no more than maxNodes - returns True if everything matched
+"""
+
+
+def runRegression(maxNodes, backend="grid", out=sys.stdout):
+    passed = True
+    totalNodes = 0
+    start = time.perf_counter()
+    for name, (fen, expectedCounts) in POSITIONS.items():
+        for depth, expected in enumerate(expectedCounts, 1):
+            if expected > maxNodes:
+                break
+            nodes = perft(loadPosition(fen, backend), depth)
+            totalNodes += nodes
+            status = "ok" if nodes == expected else "FAIL"
+            if nodes != expected:
+                passed = False
+            print("%-10s depth %d: %10d expected %10d %s" % (name, depth, nodes, expected, status), file=out)
+    elapsed = time.perf_counter() - start
+    print("%s - %d nodes in %.2fs (%d nodes/sec)" % ("passed" if passed else "FAILED", totalNodes, elapsed,
+                                                      totalNodes / max(elapsed, 1e-9)), file=out)
+    return passed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="perft move generation benchmark and correctness check")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--fen", help="position to count from (default: the start position)")
+    parser.add_argument("--position", choices=sorted(POSITIONS), help="one of the standard test positions")
+    parser.add_argument("--divide", action="store_true", help="print the node count under each root move")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="grid")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="worker processes to split the root moves over (0 = one per CPU core)")
+    parser.add_argument("--regression", action="store_true", help="check every position against published counts")
+    parser.add_argument("--max-nodes", type=int, default=100000,
+                        help="deepest regression depth to run per position, by published node count")
+    parser.add_argument("--stats", action="store_true",
+                        help="count calls and time on the move generation hot paths and print them as JSON")
+    args = parser.parse_args(argv)
+
+    if args.stats:
+        import ChessStats  # only loaded when asked for - nothing is wrapped otherwise
+        ChessStats.enable()
+
+    if args.regression:
+        status = 0 if runRegression(args.max_nodes, args.backend) else 1
+    else:
+        fen = args.fen or POSITIONS[args.position or "startpos"][0]
+        runPerft(fen, args.depth, args.backend, args.divide, args.workers or None)
+        status = 0
+    if args.stats:
+        print(ChessStats.snapshotJson(indent=2))
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+"""
+opt-in instrumentation - call counts and cumulative wall time for the move generation, attack lookup and
+make/undo hot paths
+enable() swaps the listed methods for counting wrappers and disable() puts the originals back, so while it is
+off the engine runs its own functions untouched and pays nothing at all
+
+    ChessStats.enable()
+    ...
+    print(ChessStats.snapshotJson(indent=2))
+    ChessStats.reset()
+
+times are inclusive - getValidMoves counts the time spent in the getAllPossibleMoves it calls - and counters are
+updated without a lock, so with several threads searching at once treat them as close estimates
+"""
+import functools
+import json
+import os
+import time
+
+import ChessBitboard
+import ChessEngine
+
+# methods wrapped by enable(), by class - only the ones a class defines itself are wrapped, so an overriding
+# method and the base method it calls through super() are counted separately
+# (the per piece generators are left out: GameState binds them into moveFunctions when it is created)
+HOT_PATHS = {
+    ChessEngine.GameState: ("makeMove", "undoMove", "getValidMoves", "getValidCaptures", "getValidQuiets",
+                            "getAllPossibleMoves", "getCaptureMoves", "getQuietMoves", "checkForPinsAndChecks",
+                            "inCheck", "squareUnderAttack", "squareAttackedBy", "getAttackers", "staticExchange",
+                            "getCastleMoves"),
+    ChessBitboard.BitboardGameState: ("makeMove", "undoMove", "inCheck", "squareAttackedBy", "getAttackers",
+                                      "isSquareAttacked", "attackersTo", "getAllPossibleMoves", "getCaptureMoves",
+                                      "getQuietMoves", "_generateMoves"),
+    ChessEngine.Move: ("__init__",),
+}
+
+_stats = {}  # "Class.method" -> [calls, seconds], shared with the wrapper counting into it
+_originals = {}  # (class, name) -> the function enable() replaced
+
+
+def _wrap(key, function):
+    record = _stats.setdefault(key, [0, 0.0])
+    clock = time.perf_counter
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = clock()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            record[0] += 1
+            record[1] += clock() - start
+
+    return wrapper
+
+
+"""
+Start counting - wraps the methods in hotPaths (HOT_PATHS by default); calling it again while enabled does nothing
+"""
+
+
+def enable(hotPaths=None):
+    if _originals:
+        return
+    for cls, names in (hotPaths or HOT_PATHS).items():
+        for name in names:
+            function = cls.__dict__.get(name)
+            if function is None:
+                continue
+            _originals[(cls, name)] = function
+            setattr(cls, name, _wrap(cls.__name__ + "." + name, function))
+
+
+"""
+Stop counting and restore the original methods - the counts taken so far stay available to snapshot()
+"""
+
+
+def disable():
+    for (cls, name), function in _originals.items():
+        setattr(cls, name, function)
+    _originals.clear()
+
+
+def isEnabled():
+    return bool(_originals)
+
+
+def reset():
+    for record in _stats.values():  # zeroed in place - the wrappers hold on to these lists
+        record[0] = 0
+        record[1] = 0.0
+
+
+"""
+The counts as a dict - {"enabled": bool, "functions": {"Class.method": {"calls", "seconds", "meanMicros"}}}
+with the functions that have been called, most time first
+"""
+
+
+def snapshot():
+    functions = {}
+    for key, (calls, seconds) in sorted(_stats.items(), key=lambda item: -item[1][1]):
+        if calls:
+            functions[key] = {"calls": calls, "seconds": round(seconds, 6),
+                              "meanMicros": round(seconds / calls * 1e6, 3)}
+    return {"enabled": isEnabled(), "functions": functions}
+
+
+def snapshotJson(indent=None):
+    return json.dumps(snapshot(), indent=indent)
+
+
+# CHESS_STATS=1 in the environment switches counting on for any process that imports this module
+if os.environ.get("CHESS_STATS", "") not in ("", "0"):
+    enable()
@@ -0,0 +1,518 @@
+"""
+endgame tablebases - every position of a small material set (KQK, KRK, KPK, ...) solved by retrograde analysis
+and stored as one byte per position: win, draw or loss for the side to move and the distance to mate in plies
+tables are written once offline and memory-mapped when probed, so every engine process on a host shares
+one copy and a probe is a single index calculation
+
+    python ChessTablebase.py --out tables                 build the default 3 piece tables
+    python ChessTablebase.py --out tables KQKR            4 piece sets use the same code but take far longer
+    python ChessTablebase.py --out tables --verify        check random positions against a search one ply deep
+
+the value byte is 0 for a draw (and for the impossible positions in the index) and otherwise the distance to
+mate in plies plus one - even distances lose for the side to move, odd ones win
+"""
+import argparse
+import mmap
+import os
+import random
+import struct
+import sys
+import time
+
+import ChessBitboard
+import ChessPerft
+
+WIN, DRAW, LOSS = 1, 0, -1
+PIECE_ORDER = "KQRBNP"  # piece order within one side of a signature
+PIECE_VALUES = {"K": 0, "Q": 9, "R": 5, "B": 3, "N": 3, "P": 1}
+INSUFFICIENT = ("KK", "KBK", "KNK")  # no mate possible - always a draw, no table needed
+DEFAULT_TABLES = ("KQK", "KRK", "KPK")
+MAX_PLIES = 254
+MAGIC = b"CTB1"
+HEADER = struct.Struct(">4s8sB3x")  # magic, signature, piece count
+EXTENSION = ".ctb"
+WHITE, BLACK = ChessBitboard.WHITE, ChessBitboard.BLACK
+
+
+"""
+Signatures - the white pieces then the black ones, each side starting with its king, e.g. KQKR
+tables only exist with the stronger side as white; positions with the material the other way round are
+looked up with the colors swapped and the board mirrored
+"""
+
+
+def parseSignature(signature):
+    split = signature.index("K", 1)
+    return [(WHITE, pieceType) for pieceType in signature[:split]] + \
+           [(BLACK, pieceType) for pieceType in signature[split:]]
+
+
+def _sideKey(types):
+    return len(types), sum(PIECE_VALUES[t] for t in types), tuple(-PIECE_ORDER.index(t) for t in types)
+
+
+"""
+The table signature for a list of (color, piece type) and whether the colors have to be swapped to use it
+"""
+
+
+def signatureOf(pieces):
+    white = sorted((t for color, t in pieces if color == WHITE), key=PIECE_ORDER.index)
+    black = sorted((t for color, t in pieces if color == BLACK), key=PIECE_ORDER.index)
+    if _sideKey(black) > _sideKey(white):
+        return "".join(black) + "".join(white), True
+    return "".join(white) + "".join(black), False
+
+
+def _value(byte):
+    if byte == 0:
+        return DRAW, 0
+    plies = byte - 1
+    return (LOSS if plies % 2 == 0 else WIN), plies
+
+
+class Tablebase():
+    """
+    Read side - opens the table files found in directory with mmap the first time each is needed
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.tables = {}  # signature -> (mmap, file), or None when there is no such table
+        self.maxPieces = 2
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                if name.endswith(EXTENSION):
+                    self.maxPieces = max(self.maxPieces, len(name) - len(EXTENSION))
+
+    def close(self):
+        for table in self.tables.values():
+            if table is not None:
+                table[0].close()
+                table[1].close()
+        self.tables = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _table(self, signature):
+        if signature not in self.tables:
+            path = os.path.join(self.directory, signature + EXTENSION)
+            if os.path.exists(path):
+                f = open(path, "rb")
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                magic, stored, _ = HEADER.unpack_from(mm, 0)
+                if magic != MAGIC or stored.rstrip(b"\0").decode() != signature:
+                    mm.close()
+                    f.close()
+                    raise ValueError("%s is not a tablebase for %s" % (path, signature))
+                self.tables[signature] = (mm, f)
+            else:
+                self.tables[signature] = None
+        return self.tables[signature]
+
+    """
+    (WIN / DRAW / LOSS, plies to mate) for the side to move, from a list of (color, piece type, square) -
+    None when the table for the material isn't there
+    """
+
+    def probePieces(self, pieces, sideToMove):
+        signature, flip = signatureOf([(color, t) for color, t, _ in pieces])
+        if signature in INSUFFICIENT:
+            return DRAW, 0
+        table = self._table(signature)
+        if table is None:
+            return None
+        if flip:
+            pieces = [(1 - color, t, sq ^ 56) for color, t, sq in pieces]  # mirror rows and swap colors
+            sideToMove = 1 - sideToMove
+        pieces = sorted(pieces, key=lambda piece: (piece[0], PIECE_ORDER.index(piece[1])))
+        index = sideToMove
+        for _, _, sq in pieces:
+            index = index * 64 + sq
+        return _value(table[0][HEADER.size + index])
+
+    """
+    Probe a GameState - (WIN / DRAW / LOSS, plies to mate) for the side to move, or None when the position
+    isn't covered (too many pieces, a missing table, castling rights or an en passant capture to be made)
+    """
+
+    def probe(self, gs):
+        board = gs.board
+        if 64 - sum(row.count("--") for row in board) > self.maxPieces:
+            return None
+        rights = gs.currentCastlingRight
+        if rights.wks or rights.bks or rights.wqs or rights.bqs:
+            return None
+        if gs.enpassantPossible:
+            row, col = gs.enpassantPossible
+            pawn = "wp" if gs.whiteToMove else "bp"
+            pawnRow = row + 1 if gs.whiteToMove else row - 1
+            if any(0 <= c <= 7 and board[pawnRow][c] == pawn for c in (col - 1, col + 1)):
+                return None
+        pieces = []
+        for row in range(8):
+            for col in range(8):
+                piece = board[row][col]
+                if piece != "--":
+                    pieces.append((WHITE if piece[0] == "w" else BLACK, piece[1].upper(), row * 8 + col))
+        return self.probePieces(pieces, WHITE if gs.whiteToMove else BLACK)
+
+
+"""
+Generator
+"""
+
+
+def _attackers(t, color, sq, occupied):
+    # squares a piece of type t and color on sq attacks
+    if t == "K":
+        return ChessBitboard.KING_ATTACKS[sq]
+    if t == "N":
+        return ChessBitboard.KNIGHT_ATTACKS[sq]
+    if t == "P":
+        return ChessBitboard.PAWN_ATTACKS[color][sq]
+    if t == "R":
+        return ChessBitboard.rookAttacks(sq, occupied)
+    if t == "B":
+        return ChessBitboard.bishopAttacks(sq, occupied)
+    return ChessBitboard.rookAttacks(sq, occupied) | ChessBitboard.bishopAttacks(sq, occupied)
+
+
+def _attacked(target, byColor, colors, types, squares, occupied, skip=-1):
+    for k in range(len(squares)):
+        if k != skip and colors[k] == byColor and _attackers(types[k], byColor, squares[k], occupied) >> target & 1:
+            return True
+    return False
+
+
+def _exitSignatures(pieces):
+    # tables a capture or a promotion can lead into
+    signatures = set()
+    for k, (color, t) in enumerate(pieces):
+        if t != "K":
+            signatures.add(signatureOf(pieces[:k] + pieces[k + 1:])[0])
+        if t == "P":
+            for promotion in "QRBN":
+                promoted = pieces[:k] + [(color, promotion)] + pieces[k + 1:]
+                signatures.add(signatureOf(promoted)[0])
+                for j, (other, ot) in enumerate(promoted):  # promoting with a capture
+                    if other != color and ot != "K":
+                        signatures.add(signatureOf(promoted[:j] + promoted[j + 1:])[0])
+    return signatures - set(INSUFFICIENT)
+
+
+"""
+Solve every position of signature and write the table to directory, building the tables its captures and
+promotions lead into first when they aren't there yet - returns the path written
+"""
+
+
+def buildTable(signature, directory, log=None):
+    pieces = parseSignature(signature)
+    if signatureOf(pieces) != (signature, False):
+        raise ValueError("%s is not a table signature - the stronger side comes first, e.g. %s" %
+                         (signature, signatureOf(pieces)[0]))
+    os.makedirs(directory, exist_ok=True)
+    for sub in sorted(_exitSignatures(pieces)):
+        if not os.path.exists(os.path.join(directory, sub + EXTENSION)):
+            buildTable(sub, directory, log)
+    start = time.perf_counter()
+    with Tablebase(directory) as tables:
+        values = _solve(pieces, tables)
+    path = os.path.join(directory, signature + EXTENSION)
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, signature.encode(), len(pieces)))
+        f.write(values)
+    if log is not None:
+        longest = max(values) - 1
+        print("%s: %d positions, longest mate %d plies, %.1fs" % (signature, len(values), longest,
+                                                                   time.perf_counter() - start), file=log)
+    return path
+
+
+def _solve(pieces, tables):
+    n = len(pieces)
+    colors = [color for color, _ in pieces]
+    types = [t for _, t in pieces]
+    kings = [types.index("K"), types.index("K", 1)]  # white king, black king
+    sideBit = 64 ** n
+    size = 2 * sideBit
+    place = [64 ** (n - 1 - k) for k in range(n)]  # index weight of each piece's square
+
+    legal = bytearray(size)
+    remaining = bytearray(size)  # moves staying in the table not yet known to lose for the mover
+    cannotLose = bytearray(size)  # a drawing or winning capture / promotion is available
+    lossExit = bytearray(size)  # plies to being mated through the slowest losing capture / promotion
+    winLevels = [[] for _ in range(MAX_PLIES + 2)]
+    lossLevels = [[] for _ in range(MAX_PLIES + 2)]
+
+    # pass 1 - find the legal positions
+    for index in range(size):
+        squares = _squares(index, n)
+        if len(set(squares)) != n:
+            continue
+        if any(types[k] == "P" and squares[k] // 8 in (0, 7) for k in range(n)):
+            continue
+        side = index // sideBit
+        occupied = 0
+        for sq in squares:
+            occupied |= 1 << sq
+        if _attacked(squares[kings[1 - side]], side, colors, types, squares, occupied):
+            continue  # the side that just moved left its king in check
+        legal[index] = 1
+
+    # pass 2 - count the moves of every legal position and score the ones that leave the table
+    for index in range(size):
+        if not legal[index]:
+            continue
+        side = index // sideBit
+        squares = _squares(index, n)
+        occupied = own = 0
+        for k, sq in enumerate(squares):
+            occupied |= 1 << sq
+            if colors[k] == side:
+                own |= 1 << sq
+        pieceAt = {sq: k for k, sq in enumerate(squares)}
+        moveCount = inTable = 0
+        bestWin = lossPlies = 0
+        drawExit = False
+        for k in range(n):
+            if colors[k] != side:
+                continue
+            start = squares[k]
+            t = types[k]
+            if t == "P":
+                targets = ChessBitboard.PAWN_ATTACKS[side][start] & (occupied ^ own)
+                step = -8 if side == WHITE else 8
+                if not occupied >> (start + step) & 1:
+                    targets |= 1 << (start + step)
+                    if start // 8 == (6 if side == WHITE else 1) and not occupied >> (start + 2 * step) & 1:
+                        targets |= 1 << (start + 2 * step)
+            else:
+                targets = _attackers(t, side, start, occupied) & ~own
+            for end in ChessBitboard.bitSquares(targets):
+                captured = pieceAt.get(end, -1)
+                squares[k] = end
+                after = (occupied & ~(1 << start)) | (1 << end)
+                if _attacked(squares[kings[side]], 1 - side, colors, types, squares, after, captured):
+                    squares[k] = start
+                    continue
+                moveCount += 1
+                promotions = "QRBN" if t == "P" and end // 8 in (0, 7) else None
+                if captured < 0 and promotions is None:
+                    inTable += 1
+                    squares[k] = start
+                    continue
+                for promotion in promotions or t:
+                    exitPieces = [(colors[j], promotion if j == k else types[j], squares[j])
+                                  for j in range(n) if j != captured]
+                    value, plies = tables.probePieces(exitPieces, 1 - side)
+                    if value == LOSS:
+                        bestWin = plies + 1 if bestWin == 0 else min(bestWin, plies + 1)
+                    elif value == DRAW:
+                        drawExit = True
+                    else:
+                        lossPlies = max(lossPlies, plies + 1)
+                squares[k] = start
+        if moveCount == 0:
+            if _attacked(squares[kings[side]], 1 - side, colors, types, squares, occupied):
+                lossLevels[0].append(index)  # checkmate
+            else:
+                cannotLose[index] = 1  # stalemate - never resolved, so it stays a draw
+            continue
+        remaining[index] = inTable
+        lossExit[index] = lossPlies
+        if bestWin or drawExit:
+            cannotLose[index] = 1
+        if bestWin:
+            winLevels[bestWin].append(index)
+        elif inTable == 0 and not drawExit:
+            lossLevels[lossPlies].append(index)  # every move is a capture or promotion that loses
+
+    # pass 3 - retrograde, one distance at a time: a position is won one ply after any successor is lost, and
+    # lost one ply after the last of its successors is won
+    values = bytearray(size)
+    resolved = bytearray(size)
+    for plies in range(MAX_PLIES + 1):
+        lost = plies % 2 == 0
+        for index in (lossLevels if lost else winLevels)[plies]:
+            if resolved[index]:
+                continue
+            resolved[index] = 1
+            values[index] = plies + 1
+            for previous in _unmoves(index, n, colors, types, sideBit, place):
+                if not legal[previous] or resolved[previous]:
+                    continue
+                if lost:
+                    winLevels[plies + 1].append(previous)
+                elif not cannotLose[previous]:
+                    remaining[previous] -= 1
+                    if remaining[previous] == 0:
+                        lossLevels[max(plies + 1, lossExit[previous])].append(previous)
+    return values
+
+
+def _squares(index, n):
+    squares = [0] * n
+    for k in range(n - 1, -1, -1):
+        squares[k] = index & 63
+        index >>= 6
+    return squares
+
+
+def _unmoves(index, n, colors, types, sideBit, place):
+    # indexes of the positions one move earlier that lead here without a capture or a promotion
+    side = index // sideBit
+    mover = 1 - side
+    squares = _squares(index, n)
+    occupied = 0
+    for sq in squares:
+        occupied |= 1 << sq
+    flip = sideBit if side == WHITE else -sideBit
+    for k in range(n):
+        if colors[k] != mover:
+            continue
+        end = squares[k]
+        t = types[k]
+        if t == "P":
+            step = 8 if mover == WHITE else -8  # back towards where the pawn came from
+            origins = []
+            if not occupied >> (end + step) & 1:
+                origins.append(end + step)
+                if end // 8 == (4 if mover == WHITE else 3) and not occupied >> (end + 2 * step) & 1:
+                    origins.append(end + 2 * step)
+            for start in origins:
+                if start // 8 not in (0, 7):
+                    yield index + flip + (start - end) * place[k]
+        else:
+            for start in ChessBitboard.bitSquares(_attackers(t, mover, end, occupied) & ~occupied):
+                yield index + flip + (start - end) * place[k]
+
+
+"""
+Verification - random positions of each table are probed and compared with what the table says about every
+position one move later, using GameState move generation instead of the retrograde generator
+"""
+
+
+def _fen(pieces, sideToMove):
+    board = [["1"] * 8 for _ in range(8)]
+    for color, t, sq in pieces:
+        board[sq // 8][sq % 8] = t if color == WHITE else t.lower()
+    rows = []
+    for row in board:
+        text = ""
+        for square in row:
+            if square == "1" and text[-1:].isdigit():
+                text = text[:-1] + str(int(text[-1]) + 1)
+            else:
+                text += square
+        rows.append(text)
+    return "/".join(rows) + (" w" if sideToMove == WHITE else " b") + " - - 0 1"
+
+
+def _randomPosition(pieces, rng, backend):
+    # a legal position of the material - no pawn on a back rank and the side not to move not in check
+    while True:
+        squares = rng.sample(range(64), len(pieces))
+        if any(t == "P" and sq // 8 in (0, 7) for (_, t), sq in zip(pieces, squares)):
+            continue
+        gs = ChessPerft.loadPosition(_fen([(color, t, sq) for (color, t), sq in zip(pieces, squares)],
+                                          rng.choice((WHITE, BLACK))), backend)
+        gs.whiteToMove = not gs.whiteToMove
+        if gs.inCheck():
+            continue
+        gs.whiteToMove = not gs.whiteToMove
+        return gs
+
+
+"""
+Value of gs worked out from its children - the quickest win if any move leaves the opponent lost, else a draw,
+else the slowest loss; None when a move leads into a table that isn't there
+"""
+
+
+def _searchedValue(tables, gs):
+    moves = gs.getValidMoves()
+    if not moves:
+        return (LOSS if gs.inCheck() else DRAW), 0
+    children = []
+    for move in moves:
+        gs.makeMove(move)
+        children.append(tables.probe(gs))
+        gs.undoMove()
+    if None in children:
+        return None
+    wins = [plies for value, plies in children if value == LOSS]
+    if wins:
+        return WIN, min(wins) + 1
+    if any(value == DRAW for value, _ in children):
+        return DRAW, 0
+    return LOSS, max(plies for _, plies in children) + 1
+
+
+"""
+Probe samples random positions of every table in signatures (both colors of the stronger side, both sides to
+move) and check each against _searchedValue - returns True when all of them agree
+"""
+
+
+def runVerify(directory, signatures, samples, seed=0, backend="grid", out=sys.stdout):
+    passed = True
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    with Tablebase(directory) as tables:
+        for signature in signatures:
+            if tables._table(signature) is None:
+                print("%-6s no table in %s" % (signature, directory), file=out)
+                passed = False
+                continue
+            checked = skipped = mismatches = 0
+            for i in range(samples):
+                pieces = parseSignature(signature)
+                if i % 2:
+                    pieces = [(1 - color, t) for color, t in pieces]
+                gs = _randomPosition(pieces, rng, backend)
+                expected = _searchedValue(tables, gs)
+                if expected is None:
+                    skipped += 1
+                    continue
+                checked += 1
+                found = tables.probe(gs)
+                if found != expected:
+                    mismatches += 1
+                    if mismatches <= 5:
+                        print("%-6s %s: table %s, search %s" % (signature, gs.toFen(), found, expected), file=out)
+            if mismatches:
+                passed = False
+            print("%-6s %d positions checked, %d skipped (missing tables), %d mismatches %s" % (
+                signature, checked, skipped, mismatches, "ok" if not mismatches else "FAIL"), file=out)
+    print("%s - %.2fs" % ("passed" if passed else "FAILED", time.perf_counter() - start), file=out)
+    return passed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="build endgame tablebases by retrograde analysis")
+    parser.add_argument("tables", nargs="*", default=list(DEFAULT_TABLES),
+                        help="material signatures, stronger side first (default: %s)" % " ".join(DEFAULT_TABLES))
+    parser.add_argument("--out", required=True, help="directory to write the tables to (and --verify reads)")
+    parser.add_argument("--verify", action="store_true",
+                        help="check random positions of the built tables against a search one ply deep")
+    parser.add_argument("--samples", type=int, default=1000, help="positions to check per table with --verify")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--backend", choices=sorted(ChessPerft.BACKENDS), default="grid",
+                        help="move generator --verify searches with")
+    args = parser.parse_args(argv)
+    if args.verify:
+        return 0 if runVerify(args.out, args.tables, args.samples, args.seed, args.backend) else 1
+    for signature in args.tables:
+        buildTable(signature, args.out, sys.stdout)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,248 @@
+"""
+UCI front end - speaks the Universal Chess Interface over stdin/stdout so tournament managers, analysis GUIs
+and batch match runners can drive the engine with no display
+the search runs on a ChessWorker.BackgroundEngine thread while this thread keeps reading commands, so stop and
+isready are answered straight away
+
+    python ChessUCI.py
+    CHESS_STATS=1 python ChessUCI.py    report hot path counts as an info string after every search
+                                        (or send setoption name Stats value true)
+"""
+import sys
+import threading
+import time
+
+import ChessAI
+import ChessBook
+import ChessPerft
+import ChessStats
+import ChessTablebase
+import ChessWorker
+
+ENGINE_NAME = "ChessAI"
+ENGINE_AUTHOR = "ChessEngine authors"
+MOVES_TO_GO = 30  # moves the remaining clock time is spread over when the GUI doesn't say
+MOVE_OVERHEAD_MS = 50  # kept back from every clock based move for the GUI and the pipes
+MAX_HASH_MB = 1024
+
+
+class UciServer():
+    def __init__(self, out=sys.stdout):
+        self.out = out
+        self.outLock = threading.Lock()  # info and bestmove are written from the engine thread
+        self.hashMB = ChessAI.DEFAULT_TT_MB
+        self.backend = "grid"
+        self.tablebase = None
+        self.book = None
+        self.engine = None
+        self.gs = ChessPerft.loadPosition(ChessPerft.STARTING_FEN, self.backend)
+        self.searchStart = 0
+        self.searchLock = threading.Lock()  # guards infinite and heldUpdate between the two threads
+        self.infinite = False  # the running search came from go infinite - bestmove waits for stop
+        self.heldUpdate = None  # final update of an infinite search that ended before stop arrived
+
+    def send(self, line):
+        with self.outLock:
+            self.out.write(line + "\n")
+            self.out.flush()
+
+    """
+    Read commands until quit or the end of the input
+    """
+
+    def run(self, inp=sys.stdin):
+        for line in inp:
+            if not self.handle(line):
+                break
+        self.close()
+
+    """
+    Handle one command line - returns False for quit
+    """
+
+    def handle(self, line):
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, args = tokens[0], tokens[1:]
+        if command == "uci":
+            self.send("id name " + ENGINE_NAME)
+            self.send("id author " + ENGINE_AUTHOR)
+            self.send("option name Hash type spin default %d min 1 max %d" % (ChessAI.DEFAULT_TT_MB, MAX_HASH_MB))
+            self.send("option name Backend type combo default grid" +
+                      "".join(" var " + name for name in sorted(ChessPerft.BACKENDS)))
+            self.send("option name Stats type check default false")
+            self.send("option name TablebasePath type string default <empty>")
+            self.send("option name BookFile type string default <empty>")
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "setoption":
+            self.setOption(args)
+        elif command == "ucinewgame":
+            self.close()  # a fresh engine starts with an empty transposition table
+        elif command == "position":
+            self.setPosition(args)
+        elif command == "go":
+            self.go(args)
+        elif command == "stop":
+            self.stop()
+        elif command == "quit":
+            return False
+        # anything else (debug, register, ponderhit...) is ignored as the protocol asks
+        return True
+
+    def setOption(self, args):
+        # setoption name <name> value <value>
+        if "name" not in args:
+            return
+        valueAt = args.index("value") if "value" in args else len(args)
+        name = " ".join(args[args.index("name") + 1:valueAt]).lower()
+        value = " ".join(args[valueAt + 1:])
+        if name == "hash":
+            try:
+                self.hashMB = max(1, min(int(value), MAX_HASH_MB))
+            except ValueError:
+                return
+            self.close()
+        elif name == "backend" and value in ChessPerft.BACKENDS:
+            self.backend = value
+            self.gs = ChessPerft.loadPosition(self.gs.toFen(), self.backend)
+        elif name == "tablebasepath":
+            self.close()
+            if self.tablebase is not None:
+                self.tablebase.close()
+            self.tablebase = ChessTablebase.Tablebase(value) if value and value != "<empty>" else None
+        elif name == "bookfile":
+            self.close()
+            if self.book is not None:
+                self.book.close()
+            try:
+                self.book = ChessBook.OpeningBook(value) if value and value != "<empty>" else None
+            except OSError:
+                self.book = None
+                self.send("info string cannot open book " + value)
+        elif name == "stats":
+            if value.lower() == "true":
+                ChessStats.enable()
+            else:
+                ChessStats.disable()
+
+    """
+    position startpos [moves ...] / position fen <fen> [moves ...]
+    """
+
+    def setPosition(self, args):
+        movesAt = args.index("moves") if "moves" in args else len(args)
+        if args and args[0] == "fen":
+            fen = " ".join(args[1:movesAt])
+        else:
+            fen = ChessPerft.STARTING_FEN
+        try:
+            gs = ChessPerft.loadPosition(fen, self.backend)
+        except (ValueError, IndexError, KeyError):
+            self.send("info string bad fen " + fen)
+            return
+        for notation in args[movesAt + 1:]:
+            for move in gs.getValidMoves():
+                if move.getChessNotation() == notation:
+                    gs.makeMove(move)
+                    break
+            else:
+                self.send("info string illegal move " + notation)
+                break
+        self.gs = gs
+
+    """
+    go depth <n> / movetime <ms> / nodes <n> / wtime <ms> btime <ms> [winc binc movestogo] / infinite
+    """
+
+    def go(self, args):
+        limits = {}
+        for name in ("depth", "movetime", "nodes", "wtime", "btime", "winc", "binc", "movestogo"):
+            if name in args:
+                try:
+                    limits[name] = int(args[args.index(name) + 1])
+                except (IndexError, ValueError):
+                    pass
+        timeLimitMs = limits.get("movetime")
+        clock = limits.get("wtime" if self.gs.whiteToMove else "btime")
+        if timeLimitMs is None and clock is not None:
+            increment = limits.get("winc" if self.gs.whiteToMove else "binc", 0)
+            timeLimitMs = clock // max(limits.get("movestogo", MOVES_TO_GO), 1) + increment // 2
+            timeLimitMs = max(1, min(timeLimitMs, clock - MOVE_OVERHEAD_MS))
+        if self.engine is None:
+            self.engine = ChessWorker.BackgroundEngine(self.hashMB, self.book, self.report, self.tablebase)
+        self.searchStart = time.perf_counter()
+        ChessStats.reset()
+        with self.searchLock:
+            # with no depth, time or node limit ("go infinite") the search runs until stop
+            self.infinite = timeLimitMs is None and "depth" not in limits and "nodes" not in limits
+            self.heldUpdate = None
+        self.engine.think(self.gs, timeLimitMs, limits.get("depth"), limits.get("nodes"))
+
+    """
+    End the search - an infinite search that already ended on its own (a forced mate, a tablebase position,
+    MAX_PLY) has its bestmove sent now
+    """
+
+    def stop(self):
+        with self.searchLock:
+            self.infinite = False
+            update, self.heldUpdate = self.heldUpdate, None
+        if update is not None:
+            self.sendBestmove(update)
+        elif self.engine is not None:
+            self.engine.stop()
+
+    """
+    Called on the engine thread - an info line after every completed depth, and bestmove once the search ends;
+    after go infinite the protocol allows bestmove only once stop has been received, so it is held until then
+    """
+
+    def report(self, update):
+        result = update.result
+        if not update.done:
+            elapsed = time.perf_counter() - self.searchStart
+            self.send("info depth %d score %s nodes %d time %d nps %d pv %s" % (
+                result.depth, scoreText(result.score), result.nodes, elapsed * 1000, result.nodes / max(elapsed, 1e-9),
+                " ".join(move.getChessNotation() for move in result.pv)))
+        else:
+            with self.searchLock:
+                if self.infinite:
+                    self.heldUpdate = update
+                    return
+            self.sendBestmove(update)
+
+    def sendBestmove(self, update):
+        if ChessStats.isEnabled():
+            self.send("info string stats " + ChessStats.snapshotJson())
+        bestMove = update.result.bestMove
+        self.send("bestmove " + (bestMove.getChessNotation() if bestMove is not None else "0000"))
+
+    def close(self):
+        if self.engine is not None:
+            self.engine.close()
+            self.engine = None
+
+
+"""
+A search score in UCI form - "cp <centipawns>" or "mate <moves>", negative when the engine is being mated
+"""
+
+
+def scoreText(score):
+    if abs(score) >= ChessAI.MATE_BOUND:
+        plies = ChessAI.CHECKMATE - abs(score)
+        moves = (plies + 1) // 2
+        return "mate %d" % (moves if score > 0 else -moves)
+    return "cp %d" % score
+
+
+def main():
+    UciServer().run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
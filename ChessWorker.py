@@ -0,0 +1,183 @@
+"""
+background engine - searches run on a worker thread so the caller's loop (the pygame window, the UCI reader)
+never waits on them; requests go in through one queue and EngineUpdate responses come back through another
+the caller hands over a position and later polls for updates without blocking, and can stop or cancel a
+search at any time
+
+    engine = ChessWorker.BackgroundEngine()
+    engine.think(gs, timeLimitMs=2000)
+    ...
+    update = engine.poll()  # every frame - None until something new arrives
+    if update is not None and update.done:
+        gs.makeMove(update.bestMove)
+"""
+import queue
+import threading
+import time
+
+import ChessAI
+
+WAIT_SLICE = 0.05  # seconds wait() blocks at a time before checking for a cancel
+
+
+class EngineUpdate():
+    def __init__(self, requestID, result, done, ponder=False):
+        self.requestID = requestID
+        self.result = result  # ChessAI.SearchResult of the deepest completed iteration
+        self.done = done  # False for progress updates after each iteration, True once the search has ended
+        self.ponder = ponder
+
+    @property
+    def bestMove(self):
+        return self.result.bestMove
+
+
+class _SearchRequest():
+    def __init__(self, requestID, data, gameStateClass, depth, timeLimitMs, nodeLimit, ponder):
+        self.requestID = requestID
+        self.data = data  # the position as GameState.toBinary - the worker never touches the caller's GameState
+        self.gameStateClass = gameStateClass
+        self.depth = depth
+        self.timeLimitMs = timeLimitMs
+        self.nodeLimit = nodeLimit
+        self.ponder = ponder
+        self.stopEvent = threading.Event()
+
+
+class BackgroundEngine():
+    """
+    One worker thread owning a Searcher and its transposition table, which carries over from search to search -
+    so pondering on the opponent's time leaves the table full of the positions the next search will need
+    only the newest request counts: starting a search stops the one before it and updates from older requests
+    are dropped
+    updates are queued for poll()/wait(), or handed to onUpdate on the worker thread as they happen when given
+    """
+
+    def __init__(self, ttSizeMB=ChessAI.DEFAULT_TT_MB, book=None, onUpdate=None, tablebase=None):
+        self.searcher = ChessAI.Searcher(ChessAI.TranspositionTable(ttSizeMB), tablebase)
+        self.book = book
+        self.onUpdate = onUpdate
+        self.requests = queue.Queue()
+        self.responses = queue.Queue()
+        self.lock = threading.Lock()
+        self.current = None  # newest request
+        self.nextID = 1
+        self.thread = threading.Thread(target=self._run, name="chess-engine", daemon=True)
+        self.thread.start()
+
+    """
+    Start searching gs for the side to move, replacing any search in progress - returns the request id
+    carried by its updates; with no limits at all the search runs until stop() or cancel()
+    """
+
+    def think(self, gs, timeLimitMs=None, depth=None, nodeLimit=None):
+        return self._submit(gs, depth, timeLimitMs, nodeLimit, False)
+
+    """
+    Search gs with no limit while waiting for the opponent to move - call it with the position after the
+    engine's own move; the updates are marked ponder and the search runs until the next think() or cancel()
+    """
+
+    def ponder(self, gs):
+        return self._submit(gs, None, None, None, True)
+
+    def _submit(self, gs, depth, timeLimitMs, nodeLimit, ponder):
+        with self.lock:
+            if self.current is not None:
+                self.current.stopEvent.set()
+            request = _SearchRequest(self.nextID, gs.toBinary(), type(gs), depth, timeLimitMs, nodeLimit, ponder)
+            self.nextID += 1
+            self.current = request
+        self.requests.put(request)
+        return request.requestID
+
+    """
+    End the current search early - it still finishes with a done update holding its best move so far
+    """
+
+    def stop(self):
+        with self.lock:
+            if self.current is not None:
+                self.current.stopEvent.set()
+
+    """
+    Abandon the current search, e.g. when a move is taken back - nothing more is reported for it
+    """
+
+    def cancel(self):
+        with self.lock:
+            if self.current is not None:
+                self.current.stopEvent.set()
+            self.current = None
+
+    """
+    Newest update for the current request without waiting, or None when nothing new has arrived -
+    updates for replaced or cancelled requests are thrown away
+    """
+
+    def poll(self):
+        latest = None
+        while True:
+            try:
+                update = self.responses.get_nowait()
+            except queue.Empty:
+                break
+            if self.isCurrent(update.requestID) and (latest is None or not latest.done):
+                latest = update
+        return latest
+
+    """
+    Block until the current request's search ends and return its final update - None if it was cancelled
+    """
+
+    def wait(self, timeout=None):
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            with self.lock:
+                if self.current is None:
+                    return None
+            remaining = WAIT_SLICE if deadline is None else min(WAIT_SLICE, deadline - time.monotonic())
+            if remaining <= 0:
+                return None
+            try:
+                update = self.responses.get(timeout=remaining)
+            except queue.Empty:
+                continue
+            if update.done and self.isCurrent(update.requestID):
+                return update
+
+    def isCurrent(self, requestID):
+        with self.lock:
+            return self.current is not None and self.current.requestID == requestID
+
+    def close(self):
+        self.cancel()
+        self.requests.put(None)
+        self.thread.join()
+
+    def _run(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            if request.stopEvent.is_set():
+                continue  # replaced before it started
+            gs = request.gameStateClass.fromBinary(request.data)
+            result = None
+            if self.book is not None and not request.ponder:
+                move = self.book.chooseMove(gs)
+                if move is not None:
+                    result = ChessAI.SearchResult(move, 0, [move], 0, 0)
+            if result is None:
+                def onIteration(iteration, request=request):
+                    self._report(EngineUpdate(request.requestID, iteration, False, request.ponder))
+
+                result = self.searcher.search(gs, request.depth, request.timeLimitMs, request.nodeLimit,
+                                              stopEvent=request.stopEvent, onIteration=onIteration)
+            self._report(EngineUpdate(request.requestID, result, True, request.ponder))
+
+    def _report(self, update):
+        if self.onUpdate is None:
+            self.responses.put(update)
+        elif self.isCurrent(update.requestID):
+            self.onUpdate(update)